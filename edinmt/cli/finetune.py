@@ -4,13 +4,16 @@ import contextlib
 import json
 import logging
 import os
+import pathlib
+import shlex
 import shutil
 import subprocess
 import sys
 import textwrap
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 from typing import *
 
-import yaml
 from pydantic import BaseModel, validator
 
 from edinmt import CONFIG
@@ -18,12 +21,41 @@ from edinmt.configs.config import all_members
 from edinmt.text_processors import TEXT_PROCESSORS
 from edinmt.text_processors.text_processors import TextProcessor
 from edinmt.get_settings import get_decoder_settings
-from edinmt.utils import get_file_length, fix_broken_chars
+from edinmt.utils import get_file_length, fix_and_count, yaml_load, yaml_dump
 
 #be explicit, so that logging occurs even if this is run as main
 logger = logging.getLogger('edinmt.cli.finetune')
 logger.setLevel(CONFIG.LOG_LEVEL)
 
+#the CONFIG settings as environment variables for the marian subprocess
+CONFIG_ENV = MappingProxyType({
+    x: str(y)
+    for (x, y) in all_members(CONFIG).items()
+    if not x.startswith('__')
+})
+
+def link_or_copy(src: str, dst: str) -> str:
+    r"""
+    Hardlink src to dst, so we don't copy (possibly multi-GB) model files, or
+    fall back to a real copy if we can't (e.g. dst is on another filesystem). 
+
+    NOTE: The linked files share their data with the original system, so
+    they must never be modified in-place; marian doesn't do that (it writes
+    a new model.npz), and we unlink the configs before rewriting them.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+def unlink(fp: str):
+    r"""Remove the file if it exists (e.g. to break a hardlink)."""
+    try:
+        os.remove(fp)
+    except FileNotFoundError:
+        pass
+
 class Formatter(
         argparse.ArgumentDefaultsHelpFormatter, 
         argparse.RawDescriptionHelpFormatter
@@ -42,11 +74,16 @@ def clean_pair(this_outdir, src, tgt, set_name=''):
     name = set_name + '.' if set_name else ''
     cleaned_src = os.path.join(this_outdir, f'{name}src.clean')
     cleaned_tgt = os.path.join(this_outdir, f'{name}tgt.clean')
-    if not os.path.exists(cleaned_src):
-        cleaned_src = fix_broken_chars(src, cleaned_src)
-        cleaned_tgt = fix_broken_chars(tgt, cleaned_tgt)
-    src_length = get_file_length(cleaned_src)
-    tgt_length = get_file_length(cleaned_tgt)
+    #src and tgt are independent, so clean (and count) them at the same time
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        if not os.path.exists(cleaned_src):
+            src_future = executor.submit(fix_and_count, src, cleaned_src)
+            tgt_future = executor.submit(fix_and_count, tgt, cleaned_tgt)
+        else:
+            src_future = executor.submit(get_file_length, cleaned_src)
+            tgt_future = executor.submit(get_file_length, cleaned_tgt)
+        src_length = src_future.result()
+        tgt_length = tgt_future.result()
     if src_length != tgt_length:
         msg = f"{set_name} file lengths don't match: "\
             f"{cleaned_src} ({src_length}) and " \
@@ -96,26 +133,31 @@ def main(
     decoder_settings = get_decoder_settings(
         src_lang, tgt_lang, user_settings=user_settings, extra_args=marian_args
     )
-    output_system_dir = os.path.join(output_dir, decoder_settings.system)
-    os.makedirs(output_system_dir, exist_ok=True)
-    with open(
-        os.path.join(CONFIG.SYSTEMS_DIR, decoder_settings.system, 'config.yml'), 
-        'r', encoding='utf-8'
-    ) as infile:
-        decode_config = yaml.safe_load(infile)
-        orig_model_name = os.path.basename(decode_config['models'][0])
-        orig_model = os.path.join(
-            CONFIG.SYSTEMS_DIR, decoder_settings.system, orig_model_name)
+    orig_system_dir = pathlib.Path(CONFIG.SYSTEMS_DIR, decoder_settings.system)
+    with open(orig_system_dir / 'config.yml', 'r', encoding='utf-8') as infile:
+        decode_config = yaml_load(infile)
+        orig_model_name = pathlib.PurePath(decode_config['models'][0]).name
+        orig_model = str(orig_system_dir / orig_model_name)
 
     #this will be the new traindir in which we will finetune the model
     #everything will go into the output_dir/system_name (where the system_name
     #will be the same name as our original system, so the user only has to 
     #define SYSTEMS_DIR, and the code will use the same settings)
-    this_outdir = os.path.join(output_dir, decoder_settings.system)
+    outdir_path = pathlib.Path(output_dir, decoder_settings.system)
+    this_outdir = str(outdir_path)
+    os.makedirs(this_outdir, exist_ok=True)
 
     #these will be the filepaths that we put in the various marian configs
-    pretrained_model = os.path.join(this_outdir, 'pretrained.npz')
-    finetuned_model = os.path.join(this_outdir, 'model.npz')
+    pretrained_model_name = 'pretrained.npz'
+    finetuned_model_name = 'model.npz'
+    pretrained_model = str(outdir_path / pretrained_model_name)
+
+    #the data files named in the marian train config
+    train_input = str(outdir_path / 'train.INPUT')
+    train_output = str(outdir_path / 'train.OUTPUT')
+    valid_input = str(outdir_path / 'valid.INPUT')
+    valid_output = str(outdir_path / 'valid.OUTPUT')
+    valid_ref = str(outdir_path / 'valid.REF')
 
     #update the settings with the correct traindir that we'll run marian in
     decoder_settings = get_decoder_settings(
@@ -132,94 +174,104 @@ def main(
         logger.info(f"Preparing system (copying to {this_outdir})...")
         shutil.rmtree(this_outdir)
         shutil.copytree(
-            os.path.join(CONFIG.SYSTEMS_DIR, decoder_settings.system),
+            orig_system_dir,
             this_outdir,
-            dirs_exist_ok=True
+            dirs_exist_ok=True,
+            copy_function=link_or_copy
         )
     
     #copy the pretrained model (more for recordkeeping purposes)    
     if os.path.exists(pretrained_model):
         logger.info(f"Using previously existing model for pretraining: {pretrained_model}")
     else:
-        logger.info(f"Copying {orig_model} to {pretrained_model}")
-        shutil.copy(orig_model, pretrained_model)
+        logger.info(f"Linking {orig_model} to {pretrained_model}")
+        link_or_copy(orig_model, pretrained_model)
 
-    #Remove spurrious \r, etc. which mess with line numbering
-    logger.info(f"Preparing data (fixing fake line breaks)...")
-    train_src, train_tgt = train_sets 
-    valid_src, valid_tgt = valid_sets 
-    cleaned_train_src, cleaned_train_tgt, train_length = clean_pair(
-        this_outdir, train_src, train_tgt, 'train')
-    cleaned_valid_src, cleaned_valid_tgt, valid_length = clean_pair(
-        this_outdir, valid_src, valid_tgt, 'valid')
+    #the train and valid sets are independent, so we prepare them side by side
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        #Remove spurrious \r, etc. which mess with line numbering
+        logger.info(f"Preparing data (fixing fake line breaks)...")
+        train_src, train_tgt = train_sets 
+        valid_src, valid_tgt = valid_sets 
+        train_future = executor.submit(
+            clean_pair, this_outdir, train_src, train_tgt, 'train')
+        valid_future = executor.submit(
+            clean_pair, this_outdir, valid_src, valid_tgt, 'valid')
+        cleaned_train_src, cleaned_train_tgt, train_length = train_future.result()
+        cleaned_valid_src, cleaned_valid_tgt, valid_length = valid_future.result()
 
-    #Use the TextProcessor on the data
-    if os.path.exists(os.path.join(this_outdir, 'train.INPUT')) and not force:
-        logger.info(f"Using previously generated {this_outdir}/train.* and {this_outdir}/valid.*")
-    else:
-        logger.info("Preprocessing data (moses, bpe, etc.)...")
-        tp = decoder_settings.text_processor
-        train_data = tp.prepare_training_data(
-            this_outdir,
-            src=cleaned_train_src,
-            tgt=cleaned_train_tgt
-        )
-        valid_data = tp.prepare_training_data(
-            this_outdir,
-            src=cleaned_valid_src,
-            tgt=cleaned_valid_tgt
-        )
-        #get the filenames in line with the names in the marian train config
-        shutil.move(train_data['src'], os.path.join(this_outdir, 'train.INPUT'))
-        shutil.move(train_data['tgt'], os.path.join(this_outdir, 'train.OUTPUT'))
-        shutil.move(valid_data['src'], os.path.join(this_outdir, 'valid.INPUT'))
-        shutil.move(valid_data['tgt'], os.path.join(this_outdir, 'valid.OUTPUT'))
-        shutil.copyfile(valid_tgt, os.path.join(this_outdir, 'valid.REF'))
+        #Use the TextProcessor on the data
+        if os.path.exists(train_input) and not force:
+            logger.info(f"Using previously generated {this_outdir}/train.* and {this_outdir}/valid.*")
+        else:
+            logger.info("Preprocessing data (moses, bpe, etc.)...")
+            tp = decoder_settings.text_processor
+            train_future = executor.submit(
+                tp.prepare_training_data,
+                this_outdir,
+                src=cleaned_train_src,
+                tgt=cleaned_train_tgt
+            )
+            valid_future = executor.submit(
+                tp.prepare_training_data,
+                this_outdir,
+                src=cleaned_valid_src,
+                tgt=cleaned_valid_tgt
+            )
+            train_data = train_future.result()
+            valid_data = valid_future.result()
+            #get the filenames in line with the names in the marian train config
+            shutil.move(train_data['src'], train_input)
+            shutil.move(train_data['tgt'], train_output)
+            shutil.move(valid_data['src'], valid_input)
+            shutil.move(valid_data['tgt'], valid_output)
+            unlink(valid_ref)
+            shutil.copyfile(valid_tgt, valid_ref)
 
     #edit the train config to use our pretrained model (otherwise keep it the same)
-    train_config = os.path.join(this_outdir, 'train.yml')
+    train_config = str(outdir_path / 'train.yml')
     logger.info(f"Creating train config {train_config}")
-    with open(decoder_settings.train_config, 'r', encoding='utf-8') as infile, \
-        open(train_config, 'w', encoding='utf-8') as outfile:
-        marian_config = yaml.safe_load(infile)
-        marian_config['pretrained-model'] = os.path.basename(pretrained_model)
-        yaml.dump(marian_config, outfile)
+    with open(decoder_settings.train_config, 'r', encoding='utf-8') as infile:
+        marian_config = yaml_load(infile)
+    marian_config['pretrained-model'] = pretrained_model_name
+    unlink(train_config) #it may be a hardlink to the original system's file
+    with open(train_config, 'w', encoding='utf-8') as outfile:
+        yaml_dump(marian_config, outfile)
 
     #copy decode config for later use; just change it to the finetuned model
-    decode_config_file_1 = os.path.join(this_outdir, 'config.yml')
-    decode_config_file_2 = os.path.join(this_outdir, 'config-fast.yml')
+    decode_config_file_1 = str(outdir_path / 'config.yml')
+    decode_config_file_2 = str(outdir_path / 'config-fast.yml')
     logger.info(f"Creating decode configs {decode_config_file_1}")
+    unlink(decode_config_file_1) #may be hardlinks to the original system's files
+    unlink(decode_config_file_2)
     with open(decode_config_file_1, 'w', encoding='utf-8') as outfile1, \
          open(decode_config_file_2, 'w', encoding='utf-8') as outfile2:
-        decode_config['models'] = [os.path.basename(finetuned_model)]
-        yaml.dump(decode_config, outfile1)
-        yaml.dump(decode_config, outfile2)
+        decode_config['models'] = [finetuned_model_name]
+        decode_config_yaml = yaml_dump(decode_config) #serialize only once
+        outfile1.write(decode_config_yaml)
+        outfile2.write(decode_config_yaml)
 
-    #change directory because the marian train config has relative paths;
-    #update the path of the config in the command to be just train.yml
-    cwd = os.getcwd()
-    os.chdir(this_outdir)
+    #we run marian inside this_outdir (the train config has relative paths),
+    #so update the path of the config in the command to be just train.yml
     idx = decoder_settings.cmd.index('-c') + 1
     decoder_settings.cmd[idx] = 'train.yml'
 
     #prepare the environment variables for the marian subprocess
-    my_env = os.environ.copy()
-    attrs = all_members(CONFIG)
-    for attr in attrs:
-        my_env[attr] = str(attrs[attr])
+    my_env = {**os.environ, **CONFIG_ENV}
 
-    cmd = ' '.join(decoder_settings.cmd)
-    logger.info(f'IN {this_outdir}; RUNNING: {cmd}')
+    #split the args like the shell would (e.g. --devices '0 1'), but don't
+    #actually start a shell just to start marian
+    cmd = shlex.split(' '.join(decoder_settings.cmd))
+    logger.info(f'IN {this_outdir}; RUNNING: {" ".join(cmd)}')
 
     if dry_run:
         logger.info(f"Dry run done.")
     else: 
         try:
-            subprocess.check_output(cmd, stderr=sys.stderr, shell=True, env=my_env)
+            subprocess.check_call(cmd, stderr=sys.stderr, env=my_env, cwd=this_outdir)
         except subprocess.CalledProcessError as e:
             return e.returncode
     
-    os.chdir(cwd)
     logger.info(f"Finished training in {this_outdir}")
 
 def parse_args():
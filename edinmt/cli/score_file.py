@@ -1,29 +1,38 @@
 import argparse
-import json
 import logging
 import os
+import pathlib
 import shutil
-import subprocess
+from operator import itemgetter
+from types import MappingProxyType
 from typing import *
 
 from edinmt import CONFIG
 from edinmt.get_settings import get_decoder_settings
+from edinmt.parse_marian import json_loads
+from edinmt.scorers.scorers import SacrebleuScorer
 from edinmt.translate_input import translate
 
 #be explicit, so that logging occurs even if this is run as main
 logger = logging.getLogger('edinmt.cli.score_file')
 logger.setLevel(CONFIG.LOG_LEVEL)
 
+#We don't score n-best translations with the scoring pipelines, and we use
+#plaintext because we compare it directly to the ref (unless we want to keep 
+#the json too, then we get the plaintext from the json)
+SCORING_PRESET_TEXT = MappingProxyType({
+    'NBEST': False,
+    'NBEST_WORDS': False,
+    'FMT': 'text',
+})
+SCORING_PRESET_JSON = MappingProxyType({**SCORING_PRESET_TEXT, 'FMT': 'json'})
+
 def sacrebleu_score(prediction, reference):
-    if isinstance(reference, list):
-        reference = ' '.join(reference)
-    cmd = f'cat {prediction} | sacrebleu {reference}'
-    logger.debug('RUNNING: ' + cmd)
-    result = subprocess.check_output(cmd, shell=True)
-    result = result.decode()
-    logger.debug(f"SACREBLEU RESULT: {result}")
-    bleu = result.split(" = ")[1].split(" ")[0]
-    return bleu 
+    r"""
+    Score the prediction file against one or more reference files; returns
+    the BLEU as a string with 1 decimal, same as the SacrebleuScorer.
+    """
+    return SacrebleuScorer().score_file(prediction, reference)
 
 
 def main(
@@ -65,25 +74,23 @@ def main(
             outdir = '.'
     os.makedirs(outdir, exist_ok=True)
 
-    user_settings = {'SRC': src_lang, 'TGT': tgt_lang} 
+    preset = SCORING_PRESET_JSON if CONFIG.KEEP_JSON else SCORING_PRESET_TEXT
+    user_settings = {**preset, 'SRC': src_lang, 'TGT': tgt_lang} 
     if system_name is not None:
         user_settings['SYSTEM'] = system_name
     if use_mode is not None:
         user_settings['MODE'] = use_mode
 
-    #We don't score n-best translations with this scoring pipeline
-    user_settings['NBEST'] = False 
-    user_settings['NBEST_WORDS'] = False
-    #we use plaintext because we compare this directly to the ref
-    user_settings['FMT'] = 'json'
-
     decoder_settings = get_decoder_settings(
         src_lang, tgt_lang, user_settings=user_settings, extra_args=marian_args
     )
 
-    mtout_json_fp = os.path.join(outdir, os.path.basename(src_fp) + '.mtout.json')
+    mtout_base = pathlib.Path(outdir, pathlib.PurePath(src_fp).name)
+    mtout_text_fp = str(mtout_base) + '.mtout.txt'
+    mtout_json_fp = str(mtout_base) + '.mtout.json'
+    mtout_fp = mtout_json_fp if CONFIG.KEEP_JSON else mtout_text_fp
     with open(src_fp, 'r', encoding='utf-8') as src_fh, \
-         open(mtout_json_fp, 'w', encoding='utf-8') as mtout_fh:
+         open(mtout_fp, 'w', encoding='utf-8', newline='', buffering=1 << 20) as mtout_fh:
         logger.debug(f"RUNNING: {' '.join(decoder_settings.cmd)}")
         translate(
             subcommand=decoder_settings.cmd,
@@ -95,12 +102,11 @@ def main(
             extract_tags=decoder_settings.extract_tags,
         )
 
-    mtout_text_fp = os.path.join(outdir, os.path.basename(src_fp) + '.mtout.txt')
-    with open(mtout_json_fp, 'r', encoding='utf-8') as infile, \
-         open(mtout_text_fp, 'w', encoding='utf-8') as outfile:
-        for line in infile:
-            data = json.loads(line)
-            outfile.write(data['translation'] + '\n')
+    if CONFIG.KEEP_JSON:
+        with open(mtout_json_fp, 'r', encoding='utf-8', buffering=1 << 20) as infile, \
+             open(mtout_text_fp, 'w', encoding='utf-8', buffering=1 << 20) as outfile:
+            translations = map(itemgetter('translation'), map(json_loads, infile))
+            outfile.writelines(text + '\n' for text in translations)
     
     score = sacrebleu_score(mtout_text_fp, ref_fp)
     logger.info(f"SacreBLEU SCORE {score} (SRC {mtout_text_fp} -VS- REF {ref_fp})")
@@ -2,17 +2,20 @@ import argparse
 import json
 import logging
 import os
+import queue
 import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import *
 
-import yaml
 from pydantic import BaseModel, validator
 
 from edinmt import CONFIG
 from edinmt.scorers import SCORERS, Scorer
 from edinmt import translate_file
-from edinmt.get_settings import get_decoder_settings
+from edinmt.cli.score_file import SCORING_PRESET_TEXT
+from edinmt.get_settings import get_decoder_settings_cached, split_devices
+from edinmt.utils import yaml_load
 
 #be explicit, so that logging occurs even if this is run as main
 logger = logging.getLogger('edinmt.cli.score_test_sets')
@@ -29,21 +32,85 @@ class DatasetConfig(BaseModel):
 
     @validator('src', 'ref')
     def valid_file(cls, data):
-        for v in data:
-            if not os.path.exists(v):
-                raise FileNotFoundError(f"File not found: {v}")
+        if not data:
+            return data
+        #stat them all at once; this adds up on slow shared filesystems
+        with ThreadPoolExecutor(max_workers=min(16, len(data))) as executor:
+            exists = executor.map(os.path.exists, data)
+            missing = [v for (v, ok) in zip(data, exists) if not ok]
+        if missing:
+            raise FileNotFoundError(f"File(s) not found: {', '.join(missing)}")
         return data
 
 class ConfigArgs(BaseModel):
     data: Dict[str, DatasetConfig]
 
+def _score_one(k, dataset, settings, outdir, marian_args=None, device_groups=None):
+    r"""
+    Translate and score a single test set from the config. If device_groups
+    (a queue of free device lists) is given, take a group for this test set
+    and put it back when done, so that no two test sets share GPUs.
+
+    Returns:
+        (k, {scorer_name: score, ...})
+    """
+    if device_groups is None:
+        return _score_one_on(k, dataset, settings, outdir, marian_args)
+    devices = device_groups.get()
+    try:
+        settings = {**settings, 'DEVICES': ' '.join(devices)}
+        return _score_one_on(k, dataset, settings, outdir, marian_args)
+    finally:
+        device_groups.put(devices)
+
+def _score_one_on(k, dataset, settings, outdir, marian_args=None):
+    r"""Translate and score a single test set with the given settings."""
+    settings = settings.copy()
+    settings.update(dataset.text_processor)
+    src_lang, tgt_lang = dataset.src_lang, dataset.tgt_lang
+    this_outdir = os.path.join(outdir, k)
+    os.makedirs(this_outdir, exist_ok=True)
+
+    settings['SRC'] = src_lang
+    settings['TGT'] = tgt_lang
+    #test sets often share the same system, so reuse its settings
+    decoder_settings = get_decoder_settings_cached(
+        src_lang, 
+        tgt_lang, 
+        user_settings=settings, 
+        extra_args=marian_args
+    )
+    src_data, ref_data = dataset.src, dataset.ref
+
+    final_fp = translate_file.translate(
+        decoder_settings.cmd,
+        src_data, 
+        this_outdir, 
+        text_processor=decoder_settings.text_processor,
+        n_best=decoder_settings.n_best, 
+        n_best_words=decoder_settings.n_best_words,
+        fmt=decoder_settings.fmt,
+        extract_tags=decoder_settings.extract_tags,
+        preprocess=dataset.preprocess
+    )
+
+    results = {}
+    for scorer_name in dataset.scorers:
+        scorer = SCORERS[scorer_name](**dataset.scorers[scorer_name])
+        #we only support 1 reference in this score pipeline
+        score = scorer.score_file(final_fp, ref_data[0]) 
+        logger.debug(f"{k} {scorer_name} {score} (SRC {final_fp} -VS- REF {ref_data[0]})")
+        results[scorer_name] = score 
+    return k, results
+
 def main(
         config,
         outdir,
         use_mode=None,
         systems_dir=None,
         system=None,
-        marian_args=None
+        marian_args=None,
+        jobs=None
     ):
     r"""
     Run the translation pipeline (which invokes marian-decoder) to
@@ -57,6 +124,7 @@ def main(
         systems_dir: local of the systems
         system: the system to use for scoring (folder inside the systems dir)
         marian_args: extra marian args passed directly to marian-decoder
+        jobs: number of test sets to translate at once (default from CONFIG)
 
     Example config:
         { data: { 
@@ -84,56 +152,51 @@ def main(
     """
     os.makedirs(outdir, exist_ok=True)
 
-    user_settings = {
-        'MODE': use_mode,
-        #We don't support scoring n-best translations with this score pipeline
-        'NBEST_WORDS': False,
-        'NBEST': False,
-        #we use text because we create the plaintext file for comparison 
-        'FMT': 'text'
-    }
+    user_settings = {**SCORING_PRESET_TEXT, 'MODE': use_mode}
     if systems_dir:
         user_settings['SYSTEMS_DIR'] = systems_dir
     if system:
         user_settings['SYSTEM'] = system
 
+    #test sets are independent, so we can translate several at once; if we
+    #have GPUs, we share them out among the jobs, so they don't compete
+    if jobs is None:
+        jobs = CONFIG.MAX_PARALLEL_JOBS
+    jobs = max(1, min(len(config.data), int(jobs)))
+    devices = split_devices(CONFIG.DEVICES)
+    if devices and jobs > 1 and marian_args and \
+            ('--devices' in marian_args or '-d' in marian_args):
+        #marian args override DEVICES, so every job would get the same GPUs
+        logger.warning(
+            f"Devices given in the marian args, so running 1 job at a time "
+            f"instead of {jobs}; use DEVICES to share GPUs among jobs.")
+        jobs = 1
+    if devices:
+        jobs = min(jobs, len(devices))
+
+    #each running job takes a group of GPUs from the queue and puts it back
+    #when done, so the next test set gets whichever group is actually free
+    device_groups = None
+    if jobs > 1 and devices:
+        device_groups = queue.Queue()
+        for j in range(jobs):
+            device_groups.put(devices[j::jobs])
+
     results = {}
-    for k in config.data:
-        settings = user_settings.copy() #make a new copy each iter to refresh
-        settings.update(config.data[k].text_processor)
-        src_lang, tgt_lang = config.data[k].src_lang, config.data[k].tgt_lang
-        this_outdir = os.path.join(outdir, k)
-        os.makedirs(this_outdir, exist_ok=True)
-
-        settings['SRC'] = src_lang
-        settings['TGT'] = tgt_lang
-        decoder_settings = get_decoder_settings(
-            src_lang, 
-            tgt_lang, 
-            user_settings=settings, 
-            extra_args=marian_args
-        )
-        src_data, ref_data = config.data[k].src, config.data[k].ref
-
-        final_fp = translate_file.translate(
-            decoder_settings.cmd,
-            src_data, 
-            this_outdir, 
-            text_processor=decoder_settings.text_processor,
-            n_best=decoder_settings.n_best, 
-            n_best_words=decoder_settings.n_best_words,
-            fmt=decoder_settings.fmt,
-            extract_tags=decoder_settings.extract_tags,
-            preprocess=config.data[k].preprocess
-        )
-
-        results[k] = {}
-        for scorer_name in config.data[k].scorers:
-            scorer = SCORERS[scorer_name](**config.data[k].scorers[scorer_name])
-            #we only support 1 reference in this score pipeline
-            score = scorer.score_file(final_fp, ref_data[0]) 
-            logger.debug(f"{k} {scorer_name} {score} (SRC {final_fp} -VS- REF {ref_data[0]})")
-            results[k][scorer_name] = score 
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = []
+        for k in config.data:
+            settings = user_settings.copy() #make a new copy each iter to refresh
+            futures.append(executor.submit(
+                _score_one, k, config.data[k], settings, outdir, marian_args,
+                device_groups
+            ))
+        for future in as_completed(futures):
+            k, result = future.result()
+            results[k] = result
+
+    #keep the results in the same order as the test sets in the config
+    results = {k: results[k] for k in config.data}
 
     results_fp = os.path.join(outdir, 'results.json')
     with open(results_fp, 'w', encoding='utf-8') as results_fh:
@@ -186,6 +249,8 @@ def parse_args():
         help='directory where systems are located')
     parser.add_argument('--system', default=CONFIG.SYSTEM, 
         help='name (subdir) of the system to use')
+    parser.add_argument('--jobs', type=int, default=CONFIG.MAX_PARALLEL_JOBS,
+        help='number of test sets to translate in parallel (GPUs in DEVICES are shared out among them)')
     args, rest = parser.parse_known_args()
     args.rest = rest
 
@@ -194,7 +259,7 @@ def parse_args():
 if __name__ == '__main__':
     args = parse_args()
     with open(args.config, 'r', encoding='utf-8') as infile:
-        config = yaml.safe_load(infile)
+        config = yaml_load(infile)
     logger.info(f'Score test sets: {config}')
     pconfig = ConfigArgs.parse_obj(config)
     main(
@@ -203,5 +268,6 @@ if __name__ == '__main__':
         use_mode=args.mode,
         systems_dir=args.systems_dir,
         system=args.system,
-        marian_args=args.rest
+        marian_args=args.rest,
+        jobs=args.jobs
     )
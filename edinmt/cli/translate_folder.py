@@ -35,7 +35,8 @@ def main(
         n_best=None,
         n_best_words=None,
         fmt=None, 
-        marian_args=None
+        marian_args=None,
+        jobs=None
     ):
     r"""
     Run the translation pipeline (which invokes marian-decoder) to
@@ -51,6 +52,7 @@ def main(
         fmt: output json-lines format instead of plain text
         use_mode: "fast" for single model, "accurate" for ensemble
         marian_args: extra marian args passed directly to marian-decoder
+        jobs: number of processes for pre/post-processing the files
 
     Side-effects:
         creates the output_dir with translations 
@@ -87,7 +89,8 @@ def main(
         n_best_words=decoder_settings.n_best_words,
         fmt=decoder_settings.fmt,
         extract_tags=decoder_settings.extract_tags,
-        purge=CONFIG.PURGE
+        purge=CONFIG.PURGE,
+        jobs=jobs
     )
     return returncode
 
@@ -114,6 +117,8 @@ def parse_args():
         help='return the n-best tokens for each position (n will be determined by model settings)')
     parser.add_argument('--fmt', default=CONFIG.FMT, choices=CONFIG.FMTS,
         help='output plain text instead of json-lines')
+    parser.add_argument('--jobs', default=CONFIG.CPU_COUNT, type=int,
+        help='number of processes for pre/post-processing the files')
     args, rest = parser.parse_known_args()
     args.rest = rest
 
@@ -138,5 +143,6 @@ if __name__ == '__main__':
         n_best=args.n_best,
         n_best_words=args.n_best_words, 
         fmt=args.fmt, 
-        marian_args=args.rest
+        marian_args=args.rest,
+        jobs=args.jobs
     )
\ No newline at end of file
@@ -9,6 +9,7 @@ that they have an option of how to invoke the system at runtime.
 See edinmt.get_settings for where we read and override environment variables.
 """
 import argparse
+import functools
 import logging
 import os
 import subprocess
@@ -17,9 +18,9 @@ from edinmt import CONFIG
 from edinmt.get_settings import get_decoder_settings
 from edinmt.translate_input import translate 
 
-#be explicit, so that logging occurs even if this is run as main
+#be explicit, so that logging occurs even if this is run as main; the level
+#is set in main, so that importing this module doesn't configure logging
 logger = logging.getLogger('edinmt.cli.translate_input')
-logger.setLevel(CONFIG.LOG_LEVEL)
 
 def main(
         src_lang, 
@@ -54,6 +55,8 @@ def main(
     # - MARIAN_BUILD_DIR
     # - SYSTEMS_DIR 
     """
+    logger.setLevel(CONFIG.LOG_LEVEL)
+
     user_settings = {'SRC': src_lang, 'TGT': tgt_lang} 
     if system_name is not None:
         user_settings['SYSTEM'] = system_name
@@ -81,7 +84,9 @@ def main(
         fmt=decoder_settings.fmt,
     )
 
-def parse_args():
+@functools.lru_cache(maxsize=None)
+def build_parser():
+    r"""Build the argument parser once; the CONFIG defaults are read here."""
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter, 
         description="Translate input from stdin to stdout, using the marian-decoder.",
@@ -98,7 +103,10 @@ def parse_args():
         help='return the n-best tokens for each position (n will be determined by model settings)')
     parser.add_argument('--fmt', default=CONFIG.FMT, choices=CONFIG.FMTS,
         help='output json-lines, marian format (with |||) or plain text')
-    args, rest = parser.parse_known_args()
+    return parser
+
+def parse_args(argv=None):
+    args, rest = build_parser().parse_known_args(argv)
     args.rest = rest
 
     return args
@@ -10,6 +10,7 @@ edinmt/configs/env_run.sh. When running locally (outside of Docker), you will
 want to set or export the environment variables for your local environment,
 in particular, you will need to set the paths for marian and tools.
 """
+import functools
 import logging
 import math
 import multiprocessing
@@ -17,13 +18,31 @@ import os
 import pathlib
 import socket
 
-LOCALHOST = socket.gethostbyname(socket.gethostname())
+@functools.lru_cache(maxsize=None)
+def get_localhost():
+    """Look up this host's IP; cached, and only done when needed (DNS)."""
+    return socket.gethostbyname(socket.gethostname())
+
+def __getattr__(name):
+    #LOCALHOST is looked up lazily, so importing the config doesn't hit DNS
+    if name == 'LOCALHOST':
+        return get_localhost()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _cpu_count():
+    """The number of CPUs this process may use (respects taskset/cgroups)."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+_FALSY = frozenset([False, 0, '0', 'false', 'False', 'no', 'No', 'NO'])
 
 def is_truthy(value):
     """Convert falsey values to actual False and all others to True."""
-    if value in [False, 0, '0', 'false', 'False', 'no', 'No', 'NO']:
-        return False
-    return True
+    try:
+        return value not in _FALSY
+    except TypeError: #unhashable, e.g. a list, so it can't be one of them
+        return True
 
 class Config(object):
     LOG_LEVEL = logging.INFO
@@ -119,7 +138,7 @@ class Config(object):
     #Some systems are designed to passthrough urls/emails/tags/etc. wholesale,
     #but we need extra code to extract and re-insert them, so we need to know
     #if this is one such system 
-    PASSTHROUGH_SYSTEMS = set([
+    PASSTHROUGH_SYSTEMS = frozenset([
         'kaen',
         'enka',
         'kaen_query',
@@ -130,7 +149,11 @@ class Config(object):
 
     #the CPUs to use if not using GPU; half of available CPUs by default
     CPU_COUNT = os.getenv('CPU_COUNT', 
-        max(1, math.floor(multiprocessing.cpu_count() / 2) - 1))
+        max(1, math.floor(_cpu_count() / 2) - 1))
+
+    #the max number of marian processes to run at once when we have many
+    #independent inputs (e.g. test sets); devices are shared out among them
+    MAX_PARALLEL_JOBS = int(os.getenv('MAX_PARALLEL_JOBS', 1))
 
     #Directory where marian was built, containing marian-server executable
     MARIAN_BUILD_DIR = pathlib.Path(
@@ -160,9 +183,12 @@ class Config(object):
 
     #Configs used for launching the pipeline server that sends/receives
     #requests to marian-server after pre-/post- processing the inputs.
-    MARIAN = os.getenv('MARIAN', f'ws://{LOCALHOST}:{MARIAN_PORT}')
+    MARIAN = os.getenv('MARIAN') or f'ws://{get_localhost()}:{MARIAN_PORT}'
     PIPELINE_PORT = os.getenv('PIPELINE_PORT', 8081)
     PIPELINE_HOST = os.getenv('PIPELINE_HOST', '0.0.0.0').strip()
+    #the pipeline server sends concurrent clients' lines to marian together,
+    #up to this many lines per marian request (the rest wait for the next)
+    PIPELINE_MAX_BATCH_LINES = int(os.getenv('PIPELINE_MAX_BATCH_LINES', 1000))
 
     #json-lines, marian e.g. "0 ||| sent0" or plaintext, e.g. "sent0"
     FMTS = ['json', 'marian', 'text'] 
@@ -171,12 +197,14 @@ class Config(object):
     #delete temporary files/dirs, extra logs, etc.
     PURGE = is_truthy(os.getenv('PURGE', False))
     DEBUG = is_truthy(os.getenv('DEBUG', False)) 
+    #also keep the json-lines mt output when scoring (for debugging)
+    KEEP_JSON = is_truthy(os.getenv('KEEP_JSON', False))
 
     #allow instances of config to be updated from keyword args on the fly;
     #useful for changing runtime settings from user inputs instead of using
     #pre-defined environment variable settings 
     def __init__(self, **kwargs):
-        [setattr(self, k, kwargs[k]) for k in kwargs]
+        self.__dict__.update(kwargs)
     
 
 class TestConfig(Config):
@@ -187,6 +215,9 @@ class TestConfig(Config):
     #delete temporary files/dirs, extra logs, etc.
     PURGE = is_truthy(os.getenv('PURGE', False)) 
     DEBUG = is_truthy(os.getenv('DEBUG', True)) 
+    #the number of decoders that tests may run at once (e.g. in test_langs);
+    #more only helps if there are enough cores/GPUs to go around
+    TEST_WORKERS = int(os.getenv('TEST_WORKERS', 1))
 
 
 def all_members(aClass):
@@ -197,17 +228,9 @@ def all_members(aClass):
     Acknowledgements:
     https://www.oreilly.com/library/view/python-cookbook/0596001673/ch05s03.html
     """
-    try:
-        # Try getting all relevant classes in method-resolution order
-        mro = list(aClass.__mro__)
-    except AttributeError:
-        # If a class has no __mro__, then it's a classic class
-        def getmro(aClass, recurse):
-            mro = [aClass]
-            for base in aClass.__bases__: mro.extend(recurse(base, recurse))
-            return mro
-        mro = getmro(aClass, getmro)
-    mro.reverse()
-    members = {}
-    for someClass in mro: members.update(vars(someClass))
-    return members
\ No newline at end of file
+    #superclasses first, so that subclasses override their members
+    return {
+        k: v
+        for someClass in reversed(aClass.__mro__)
+        for (k, v) in vars(someClass).items()
+    }
\ No newline at end of file
@@ -5,60 +5,321 @@ results to an output directory with the same directory structure. Any
 subprocess can be invoked on for processing the files.
 """
 import argparse
+import collections
+import functools
 import logging
 import os
+import selectors
 import subprocess
 import sys
-import threading
-import queue
+from concurrent.futures import ThreadPoolExecutor
 from typing import *
 from typing import IO #the * above won't load this
+try:
+    import fcntl
+except ImportError: #not on windows
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
-def _mux(input_dir: str, process_stdin: IO, q: queue.Queue):
-    r"""Write files in the input_dir to the stdin and track them in the q."""
-    for (base, unused_dirs, files) in os.walk(input_dir):
-        for file_name in files:
-            name = os.path.join(base, file_name)
-            with open(name, "rb") as f:
-                count = 0
-                for line in f:
-                    process_stdin.write(line)
-                    count += 1
-            relative_name = os.path.relpath(name, input_dir)
-            q.put((relative_name, count))
-    q.put(None) #poison
-    process_stdin.close()
-
-def _demux(output_dir: str, process_stdout: IO, q: queue.Queue):
-    r"""Read tracking from q and write stdout lines to files in output_dir."""
-    while True:
-        item = q.get()
+def _list_files(input_dir: str) -> List[str]:
+    r"""
+    Recursively list the files in the input_dir, biggest first, so that the
+    subprocess sees similar-sized inputs together (e.g. helps marian batch).
+    """
+    files = []
+    stack = [input_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink(): #like os.walk, don't follow
+                        stack.append(entry.path)
+                else:
+                    files.append((entry.stat().st_size, entry.path))
+    files.sort(key=lambda x: x[0], reverse=True)
+    return [name for (size, name) in files]
+
+def _count_lines(name: str, chunk_size: Optional[int]=1 << 20) -> Tuple[int, bool]:
+    r"""
+    Count the lines in the file, including a last line without a trailing
+    newline. Returns (count, whether the trailing newline is missing).
+
+    NOTE: We read into one reusable buffer, so we don't allocate a new 
+    bytes object per chunk (mmap would avoid the read, but it can't count).
+    """
+    count = 0
+    last = None
+    buffer = bytearray(chunk_size)
+    with open(name, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            if n < len(buffer):
+                del buffer[n:]
+            count += buffer.count(b"\n")
+            last = buffer[-1]
+    missing_newline = last is not None and last != ord("\n")
+    return count + missing_newline, missing_newline
+
+def _grow_pipe(fd: int, size: Optional[int]=1 << 20):
+    r"""
+    Try to grow the pipe buffer from the default 64KiB (Linux only), so the
+    subprocess can write out whole batches without waiting on us and vice
+    versa. It's fine if we can't (e.g. the size is over pipe-max-size).
+    """
+    if fcntl is None:
+        return
+    try:
+        fcntl.fcntl(fd, getattr(fcntl, 'F_SETPIPE_SZ', 1031), size)
+    except OSError:
+        pass
+
+class _Muxer(object):
+    r"""
+    Send the files in the input_dir to the process stdin, in big chunks (or
+    with sendfile, so the bytes never pass through python), and track them
+    (relative name and line count) in the pending deque.
+    """
+    def __init__(
+            self, 
+            input_dir: str, 
+            fd: int, 
+            pending: collections.deque, 
+            executor: ThreadPoolExecutor
+        ):
+        self.input_dir = input_dir
+        self.fd = fd
+        self.pending = pending
+        #count the upcoming files in the background while we send the 
+        #current one, so the disk reads overlap with the pipe writes; we 
+        #count before sending, so that the demuxer knows where a file's
+        #output ends before we've even finished sending it
+        files = _list_files(input_dir)
+        self.files = zip(files, executor.map(_count_lines, files))
+        self.infile = None
+        self.offset = 0
+        self.missing_newline = False
+        self.buffer = b""
+        #copy straight from the file to the pipe in the kernel if we can
+        self.sendfile = hasattr(os, 'sendfile')
+
+    def _next_file(self) -> bool:
+        r"""Open the next file to send; return False if there are no more."""
+        item = next(self.files, None)
         if item is None:
-            break
-        relative_name, count = item
-        name = os.path.join(output_dir, relative_name)
-        os.makedirs(os.path.dirname(name), exist_ok=True)
-        with open(name, "wb") as out:
-            for l in range(count):
-                line = process_stdout.readline()
-                out.write(line)
-        q.task_done()
-
-def mux_demux(input_dir: str, output_dir: str, process_stdin: IO, process_stdout: IO):
+            return False
+        name, (count, self.missing_newline) = item
+        relative_name = os.path.relpath(name, self.input_dir)
+        self.pending.append((relative_name, count))
+        self.infile = open(name, "rb")
+        self.offset = 0
+        return True
+
+    def _send_file(self) -> int:
+        r"""Send the next chunk of the current file; return 0 at its end."""
+        if self.sendfile:
+            try:
+                return os.sendfile(
+                    self.fd, self.infile.fileno(), self.offset, 1 << 20)
+            except (BlockingIOError, BrokenPipeError):
+                raise
+            except OSError: #e.g. the kernel can't sendfile to a pipe
+                self.sendfile = False
+                self.infile.seek(self.offset)
+        chunk = self.infile.read(1 << 20)
+        self.buffer = memoryview(chunk)
+        return len(chunk)
+
+    def on_writable(self) -> bool:
+        r"""Write as much as the pipe takes; return False when we're done."""
+        try:
+            if self.buffer:
+                n = os.write(self.fd, self.buffer)
+                self.buffer = self.buffer[n:]
+                return True
+            if self.infile is None and not self._next_file():
+                return False
+            n = self._send_file()
+        except BlockingIOError:
+            return True
+        if self.sendfile:
+            self.offset += n
+        if not n:
+            self.infile.close()
+            self.infile = None
+            #don't let the last line run into the next file's first line
+            if self.missing_newline:
+                self.buffer = b"\n"
+        return True
+
+class _Demuxer(object):
+    r"""
+    Read the process stdout in big blocks and write the lines to files in 
+    the output_dir, according to the pending (relative name, count) deque.
+    """
+    def __init__(self, output_dir: str, fd: int, pending: collections.deque):
+        self.output_dir = output_dir
+        self.fd = fd
+        self.pending = pending
+        self.outfile = None
+        self.remaining = 0
+        self.tail = b"" #what we've read but not written yet
+
+    def _drain(self, eof: Optional[bool]=False):
+        r"""
+        Write all the complete lines we have to their files. We only move an
+        offset through the tail, and trim it once at the end, so a block that
+        completes many (short) files isn't rescanned and copied per file.
+        """
+        tail = memoryview(self.tail)
+        start = 0
+        newlines = self.tail.count(b"\n") #complete lines left in the tail
+        while self.pending:
+            if self.outfile is None:
+                relative_name, self.remaining = self.pending[0]
+                name = os.path.join(self.output_dir, relative_name)
+                os.makedirs(os.path.dirname(name), exist_ok=True)
+                self.outfile = open(name, "wb")
+            if self.remaining > newlines:
+                #the file continues in the next block, so it gets all of it
+                self.remaining -= newlines
+                newlines = 0
+                end = len(tail)
+            else:
+                end = start
+                for _ in range(self.remaining):
+                    end = self.tail.index(b"\n", end) + 1
+                newlines -= self.remaining
+                self.remaining = 0
+            if end > start:
+                self.outfile.write(tail[start:end])
+                start = end
+            if self.remaining > 0 and not eof:
+                break
+            self.outfile.close()
+            self.outfile = None
+            self.pending.popleft()
+        self.tail = self.tail[start:]
+
+    def feed(self, data: bytes):
+        r"""Write the output data to files; empty data means the end."""
+        self.tail += data
+        self._drain(eof=not data)
+
+    def on_readable(self) -> bool:
+        r"""Read what's available; return False when the stdout is closed."""
+        try:
+            data = os.read(self.fd, 1 << 20)
+        except BlockingIOError:
+            return True
+        self.feed(data)
+        return bool(data)
+
+def mux_demux(
+        input_dir: str, 
+        output_dir: str, 
+        process_stdin: Union[IO, int], 
+        process_stdout: Union[IO, int], 
+        prefetch: Optional[int]=4
+    ):
     r"""
     Read files in the input_dir, send them to process_stdin, receive results
     from process_stdout, and write the results to new files in the output_dir
     with the same directory structure.
+
+    Both pipes are serviced from one thread with a selector, so neither
+    side can block the other (and there's no thread switching on the GIL).
+    The pipes can be file objects or raw file descriptors; either way we
+    only use the raw descriptors, and close the stdin when we're done.
+    """
+    pending = collections.deque()
+    as_fd = lambda x: x if isinstance(x, int) else x.fileno()
+    stdin_fd = as_fd(process_stdin)
+    stdout_fd = as_fd(process_stdout)
+    for fd in (stdin_fd, stdout_fd):
+        os.set_blocking(fd, False)
+        _grow_pipe(fd)
+    with ThreadPoolExecutor(max_workers=prefetch) as executor, \
+         selectors.DefaultSelector() as selector:
+        muxer = _Muxer(input_dir, stdin_fd, pending, executor)
+        demuxer = _Demuxer(output_dir, stdout_fd, pending)
+        selector.register(stdin_fd, selectors.EVENT_WRITE, muxer.on_writable)
+        selector.register(stdout_fd, selectors.EVENT_READ, demuxer.on_readable)
+        while selector.get_map():
+            for (key, mask) in selector.select():
+                if not key.data():
+                    selector.unregister(key.fd)
+                    if key.fd == stdin_fd: #signal EOF to the process
+                        if isinstance(process_stdin, int):
+                            os.close(process_stdin)
+                        else:
+                            process_stdin.close()
+
+def mux_demux_ws(
+        input_dir: str, 
+        output_dir: str, 
+        url: str, 
+        batch_size: Optional[int]=64,
+        sort_window: Optional[int]=4096,
+    ):
+    r"""
+    Like mux_demux, but send the lines to an already running marian-server
+    at the websocket url, batch_size lines per request (marian-server takes
+    many newline separated sentences at once), instead of to a subprocess.
+
+    Like marian's --maxi-batch-sort, we collect sort_window lines at a time
+    and sort them by length, so each request has similar length sentences
+    (less padding on the GPU), and then put the results back in order.
+    Identical lines within the window are only translated once.
     """
-    q = queue.Queue()
-    muxer = threading.Thread(target=_mux, args=(input_dir, process_stdin, q))
-    demuxer = threading.Thread(target=_demux, args=(output_dir, process_stdout, q))
-    muxer.start()
-    demuxer.start()
-    muxer.join()
-    demuxer.join()
+    import websocket #only needed here; the subprocess mode has no deps
+
+    pending = collections.deque()
+    demuxer = _Demuxer(output_dir, None, pending)
+    ws = websocket.create_connection(url)
+
+    def send(batch):
+        ws.send('\n'.join(batch))
+        lines = ws.recv().split('\n')
+        if len(lines) == len(batch) + 1 and not lines[-1]:
+            lines.pop() #the reply ended with a newline
+        if len(lines) != len(batch):
+            #padding or cutting would silently misalign the output files
+            raise ValueError(
+                f"ERROR: Expected {len(batch)} lines from {url}, got {len(lines)}")
+        return lines
+
+    def translate_window(window):
+        #repeated lines (boilerplate, empty lines, etc.) only get sent once
+        unique = list(dict.fromkeys(window))
+        unique.sort(key=lambda line: len(line.split()))
+        translations = {}
+        for k in range(0, len(unique), batch_size):
+            batch = unique[k:k + batch_size]
+            translations.update(zip(batch, send(batch)))
+        results = [translations[line] for line in window]
+        demuxer.feed('\n'.join(results).encode('utf-8') + b'\n')
+
+    try:
+        window = []
+        for name in _list_files(input_dir):
+            count, _ = _count_lines(name)
+            pending.append((os.path.relpath(name, input_dir), count))
+            with open(name, "rb") as f:
+                for line in f:
+                    #like the subprocess mode, don't stop on a bad byte, and
+                    #don't send the \r of windows line endings to marian
+                    window.append(line.rstrip(b"\r\n").decode('utf-8', errors='replace'))
+                    if len(window) == sort_window:
+                        translate_window(window)
+                        window = []
+        if window:
+            translate_window(window)
+        demuxer.feed(b"")
+    finally:
+        ws.close()
 
 def main(input_dir: str, output_dir: str, subcommand: list):
     r"""
@@ -73,12 +334,22 @@ def main(input_dir: str, output_dir: str, subcommand: list):
         creates an output_dir with the same directory structure as the
             input_dir, but with files processed by the subcommand
     """
-    process = subprocess.Popen(subcommand, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=sys.stderr)
-    mux_demux(input_dir, output_dir, process.stdin, process.stdout)
+    #use raw pipes, we don't need Popen's buffered file objects on top of them
+    #(os.pipe fds are already non-inheritable, i.e. close-on-exec)
+    stdin_r, stdin_w = os.pipe()
+    stdout_r, stdout_w = os.pipe()
+    process = subprocess.Popen(subcommand, stdin=stdin_r, stdout=stdout_w, stderr=sys.stderr)
+    os.close(stdin_r)
+    os.close(stdout_w)
+    try:
+        mux_demux(input_dir, output_dir, stdin_w, stdout_r)
+    finally:
+        os.close(stdout_r)
     sys.exit(process.wait())
 
-def parse_args():
-    r"""Parse command line args for process_folder.py"""
+@functools.lru_cache(maxsize=None)
+def build_parser():
+    r"""Build the argument parser for mux_demux.py once."""
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter, 
         description="Process a folder of files into output files following the same directory structure, using a shell subprocess.",
@@ -88,19 +359,35 @@ def parse_args():
         help="a folder consisting of input files to the command (all files in the directory will be processed)")
     parser.add_argument('output_dir', 
         help="the output directory where to save new files")
-    args, rest = parser.parse_known_args()
+    parser.add_argument('--server', default=None,
+        help="instead of a subprocess, use the marian-server running at this websocket url (e.g. ws://localhost:8080/translate)")
+    parser.add_argument('--batch-size', default=64, type=int,
+        help="the number of lines to send per request to the --server")
+    parser.add_argument('--sort-window', default=4096, type=int,
+        help="the number of lines to sort by length before batching them for the --server")
+    return parser
+
+def parse_args(argv=None):
+    r"""Parse command line args for mux_demux.py"""
+    args, rest = build_parser().parse_known_args(argv)
     args.rest = rest
 
     if not os.path.exists(args.input_dir):
         raise FileNotFoundError(f"Folder not found: {args.input_dir}")
     if not os.path.isdir(args.input_dir):
         raise NotADirectoryError(f"File is not a directory: {args.input_dir}")
-    if not args.rest:
+    if not args.rest and not args.server:
         raise BaseException(f"Process to invoke not provided.")
 
     return args
 
 if __name__ == '__main__':
     args = parse_args()
-    main(args.input_dir, args.output_dir, args.rest)
+    if args.server:
+        mux_demux_ws(
+            args.input_dir, args.output_dir, args.server, 
+            args.batch_size, args.sort_window
+        )
+    else:
+        main(args.input_dir, args.output_dir, args.rest)
 
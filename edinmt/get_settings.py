@@ -14,17 +14,19 @@ edinmt/configs/config.py, so that we can use it to override the config.
 """
 #TODO: Can we simplify all of this somehow, maybe switch to pydantic?
 
+import functools
 import logging
 import os
 import pathlib
 import shutil
 from collections import namedtuple
-
-import yaml
+from collections.abc import Mapping
+from types import MappingProxyType
 
 from edinmt import CONFIG
 from edinmt.configs.config import all_members
 from edinmt.text_processors import TEXT_PROCESSORS
+from edinmt.utils import yaml_load
 
 logger = logging.getLogger(__name__)
 logger.setLevel(CONFIG.LOG_LEVEL)
@@ -88,7 +90,7 @@ def get_decoder_settings(
         ]
     )
     #1. create a settings dictionary for all the other functions to use
-    settings = {x:y for (x,y) in all_members(config).items() if not x.startswith('__')}
+    settings = dict(_base_settings(config))
     if user_settings:
         settings.update(user_settings)
 
@@ -146,6 +148,82 @@ def get_decoder_settings(
 
     return decoder_settings 
 
+@functools.lru_cache(maxsize=4)
+def _base_settings(config):
+    r"""
+    The config members as a read-only dict, cached per config, so that we 
+    don't reflect over the config class on every call. Copy it to modify it.
+    """
+    return MappingProxyType(
+        {x:y for (x,y) in all_members(config).items() if not x.startswith('__')}
+    )
+
+#DecoderSettings already built by get_decoder_settings_cached, by call args
+_DECODER_SETTINGS_CACHE = {}
+
+def _freeze(value):
+    r"""Recursively convert dicts/lists/sets into hashable equivalents."""
+    if isinstance(value, Mapping):
+        return tuple(sorted((k, _freeze(v)) for (k, v) in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    return value
+
+def get_decoder_settings_cached(
+        src_lang=None, 
+        tgt_lang=None, 
+        config=CONFIG, 
+        user_settings=None, 
+        extra_args=None, 
+        server=False,
+        traindir=False
+    ):
+    r"""
+    Same as get_decoder_settings, but remember the result for the same
+    arguments, so repeated calls don't re-read the marian configs and 
+    re-load the text processor (e.g. bpe models) every time.
+
+    NOTE: The text_processor is shared between all calls with the same
+    arguments, and changes on disk (e.g. to the systems dir) won't be seen
+    after the first call. The cmd is copied, so callers may modify it.
+    """
+    key = (
+        src_lang, 
+        tgt_lang, 
+        config, 
+        _freeze(user_settings), 
+        _freeze(extra_args), 
+        server, 
+        traindir
+    )
+    decoder_settings = _DECODER_SETTINGS_CACHE.get(key)
+    if decoder_settings is None:
+        decoder_settings = get_decoder_settings(
+            src_lang, 
+            tgt_lang, 
+            config=config, 
+            user_settings=user_settings, 
+            extra_args=extra_args, 
+            server=server,
+            traindir=traindir
+        )
+        _DECODER_SETTINGS_CACHE[key] = decoder_settings
+    return decoder_settings._replace(cmd=list(decoder_settings.cmd))
+
+def clear_caches():
+    r"""
+    Forget everything cached about the systems/marian dirs and configs, e.g.
+    in tests, or after adding a system or rebuilding marian in this process.
+    """
+    _DECODER_SETTINGS_CACHE.clear()
+    _resolve_marian_config.cache_clear()
+    _base_settings.cache_clear()
+    _list_systems.cache_clear()
+    _resolve_marian.cache_clear()
+    _load_marian_config.cache_clear()
+
 def _get_text_processor(src_lang, tgt_lang, settings):
     r"""Instantiate a text pre-/post-text_processor that's used on each sentence."""
     if settings['SYSTEM'] is None:
@@ -175,9 +253,40 @@ def _find_audio_type_langs(settings):
         tgt_lang = settings['TGT']
     return src_lang, tgt_lang
 
+@functools.lru_cache(maxsize=8)
+def _list_systems(systems_dir, mtime):
+    r"""
+    List the systems in the systems_dir; cached by (dir, mtime), and the dir
+    mtime changes whenever a system is added or removed.
+    """
+    return frozenset(os.listdir(systems_dir))
+
+def _langs_to_systems(system_to_langs):
+    r"""
+    Invert {system: [(src, tgt), ...]} into {'srctgt': [system, ...]}, from
+    the settings' own SYSTEM_TO_LANGS, so user overrides of it are respected.
+    """
+    frozen = tuple(
+        (system, tuple(tuple(direction) for direction in directions))
+        for (system, directions) in system_to_langs.items()
+    )
+    return _invert_system_to_langs(frozen)
+
+@functools.lru_cache(maxsize=8)
+def _invert_system_to_langs(system_to_langs):
+    r"""The cached inversion, keyed on a frozen copy of SYSTEM_TO_LANGS."""
+    langs_to_systems = {}
+    for (system, directions) in system_to_langs:
+        for (src, tgt) in directions:
+            langs_to_systems.setdefault(f"{src}{tgt}", []).append(system)
+    return MappingProxyType(
+        {langs: tuple(systems) for (langs, systems) in langs_to_systems.items()}
+    )
+
 def _find_system(settings):
     r"""Infer the system based on the SRC/TGT lang in the settings."""
-    systems = os.listdir(settings['SYSTEMS_DIR'])
+    systems_dir = settings['SYSTEMS_DIR']
+    systems = _list_systems(systems_dir, os.stat(systems_dir).st_mtime_ns)
 
     target_system = settings['SYSTEM']
     if not target_system:
@@ -192,13 +301,8 @@ def _find_system(settings):
 
     #maybe we can still recognize the system from the language direction
     if target_system not in systems:
-        possibilities = []
-
-        for k in settings['SYSTEM_TO_LANGS']:
-            directions = settings['SYSTEM_TO_LANGS'][k]
-            for tup in directions:
-                if f"{tup[0]}{tup[1]}" == target_system:
-                    possibilities.append(k)
+        langs_to_systems = _langs_to_systems(settings['SYSTEM_TO_LANGS'])
+        possibilities = list(langs_to_systems.get(target_system, []))
 
         if len(possibilities) > 1:
             msg = f"Multiple possible systems for lang combo. Please use SYSTEM env variable or --system flag to select specific system, choose from: {possibilities}"
@@ -206,7 +310,7 @@ def _find_system(settings):
             logger.debug(f"SETTINGS: {settings}")
             raise KeyError(msg)
         elif len(possibilities) == 0:
-            msg = f"Unrecognized system: {target_system}; expected one of {systems}"
+            msg = f"Unrecognized system: {target_system}; expected one of {sorted(systems)}"
             logger.error(msg)
             logger.debug(f"SETTINGS: {settings}")
             raise KeyError(msg)
@@ -222,19 +326,27 @@ def _find_marian(settings, server=False, traindir=False):
     else:
         marian_build_dir = settings['MARIAN_BUILD_DIR']
 
+    if traindir:
+        name = 'marian'
+    elif server:
+        name = 'marian-server'
+    else:
+        name = 'marian-decoder'
+
+    return _resolve_marian(marian_build_dir, name)
+
+@functools.lru_cache(maxsize=None)
+def _resolve_marian(marian_build_dir, name):
+    r"""
+    Check that the marian executable exists; cached, so that we only stat it
+    once per process (failures raise, so they aren't cached).
+    """
     if not os.path.isdir(marian_build_dir):
         msg = f"Not a directory; marian not found: {marian_build_dir}"
         logger.error(msg)
-        logger.debug(f"SETTINGS: {settings}")
         raise NotADirectoryError(msg)
 
-    if server:
-        marian = os.path.join(marian_build_dir, 'marian-server')
-    if traindir:
-        marian = os.path.join(marian_build_dir, 'marian')
-    else:
-        marian = os.path.join(marian_build_dir, 'marian-decoder')
-
+    marian = os.path.join(marian_build_dir, name)
     if not os.path.exists(marian):
         msg = f"marian not found: {marian}"
         logger.error(msg)
@@ -250,18 +362,17 @@ def _find_marian_config(settings: dict, traindir=False):
         logger.debug(f"SETTINGS: {settings}")
         raise KeyError(msg)
 
-    model_dir = os.path.join(settings['SYSTEMS_DIR'], settings['SYSTEM'])
-    if not os.path.isdir(model_dir):
-        msg = f"Not a directory; model not found (did you set the SYSTEM?): {model_dir}"
-        logger.error(msg)
-        logger.debug(f"SETTINGS: {settings}")
-        raise NotADirectoryError(msg)
-
     if settings['MODE'] is None:
         settings['MODE'] = 'DEFAULT'
+    if settings['MODE'] not in settings['MODE_TO_MARIAN_CONFIG']:
+        msg = f"Unrecognized MODE: {settings['MODE']}; expected one of {list(settings['MODE_TO_MARIAN_CONFIG'])}"
+        logger.error(msg)
+        logger.debug(f"SETTINGS: {settings}")
+        raise KeyError(msg)
 
+    model_dir = os.path.join(settings['SYSTEMS_DIR'], settings['SYSTEM'])
     config_filename = settings['MODE_TO_MARIAN_CONFIG'][settings['MODE']] 
-    marian_config_path = os.path.join(model_dir, config_filename)
+    marian_config_path = _resolve_marian_config(model_dir, config_filename)
 
     #additionally, copy default train config and validate.sh files for finetuning
     train_config, validate_sh = None, None
@@ -271,19 +382,59 @@ def _find_marian_config(settings: dict, traindir=False):
         if not os.path.exists(train_config):
             marian_config_templ = os.path.join(settings['ROOT_DIR'], 'edinmt', 'configs', 'train.DEFAULT.yml')
             shutil.copyfile(marian_config_templ, train_config)
-        validate_sh = os.path.join(model_dir, 'validate.sh')
         if not os.path.exists(validate_sh):
             validate_templ = os.path.join(settings['ROOT_DIR'], 'edinmt', 'configs', 'validate_DEFAULT.sh')
             shutil.copyfile(validate_templ, validate_sh)
 
+    return marian_config_path, train_config, validate_sh
+
+@functools.lru_cache(maxsize=64)
+def _resolve_marian_config(model_dir, config_filename):
+    r"""
+    Check that the model dir and its marian config exist; cached, so that we
+    only stat them once per (system, mode) (failures raise, so aren't cached).
+    """
+    if not os.path.isdir(model_dir):
+        msg = f"Not a directory; model not found (did you set the SYSTEM?): {model_dir}"
+        logger.error(msg)
+        raise NotADirectoryError(msg)
+
+    marian_config_path = os.path.join(model_dir, config_filename)
     if not os.path.exists(marian_config_path):
         msg = f"Marian config not found: {marian_config_path}"
         logger.error(msg)
-        logger.debug(f"SETTINGS: {settings}")
         raise FileNotFoundError(msg)
-        
-    return marian_config_path, train_config, validate_sh
+
+    return marian_config_path
     
+#strip quotes and turn commas into spaces in a device list, e.g. '"0,1"'
+_DEVICES_TABLE = str.maketrans({'"': None, "'": None, ',': ' '})
+
+def split_devices(devices):
+    r"""Split a devices setting such as '0,1', '"0 1"' or [0, 1] into ids."""
+    if not devices:
+        return []
+    if isinstance(devices, (list, tuple)):
+        devices = ' '.join(str(d) for d in devices)
+    return str(devices).translate(_DEVICES_TABLE).split()
+
+@functools.lru_cache(maxsize=32)
+def _load_marian_config(marian_config_path, mtime):
+    r"""
+    Parse the marian config yaml; cached by (path, mtime), so that we only
+    parse it again if it's changed. NOTE: Don't modify the returned dict.
+    """
+    with open(marian_config_path, 'r', encoding='utf-8') as infile:
+        return yaml_load(infile)
+
+def _index_flags(args):
+    r"""Map each flag (e.g. '--devices') in the args to its first index."""
+    flags = {}
+    for (i, arg) in enumerate(args):
+        if isinstance(arg, str) and arg.startswith('-'):
+            flags.setdefault(arg, i)
+    return flags
+
 def _collect_marian_args(settings, extra_args=None, traindir=None):
     r"""
     Read from environment configs, marian config and user-provided extra_args,
@@ -297,11 +448,14 @@ def _collect_marian_args(settings, extra_args=None, traindir=None):
     n_best_words = settings['NBEST_WORDS']
     fmt = settings['FMT']
 
+    #index the flags once, instead of searching the list for every flag
+    flags = _index_flags(extra_args)
+
     #find config
-    if '-c' in extra_args: 
-        marian_config_path = extra_args[extra_args.index('-c') + 1]
-    elif '--config' in extra_args: 
-        marian_config_path = extra_args[extra_args.index('--config') + 1]
+    if '-c' in flags: 
+        marian_config_path = extra_args[flags['-c'] + 1]
+    elif '--config' in flags: 
+        marian_config_path = extra_args[flags['--config'] + 1]
     else:
         marian_config_path, train_config, validate_sh = _find_marian_config(
             settings=settings, traindir=traindir)
@@ -312,8 +466,8 @@ def _collect_marian_args(settings, extra_args=None, traindir=None):
             extra_args.append(marian_config_path)
 
     #read some values directly from marian config 
-    with open(marian_config_path, 'r', encoding='utf-8') as infile:
-        marian_config = yaml.safe_load(infile) 
+    marian_config = _load_marian_config(
+        marian_config_path, os.path.getmtime(marian_config_path))
     beam_size = int(marian_config['beam-size'])
     batch_size = None
     max_sent_length = None
@@ -325,43 +479,36 @@ def _collect_marian_args(settings, extra_args=None, traindir=None):
         max_sent_length = int(marian_config['max-length'])
     elif 'mini-batch-words' in marian_config:
         max_sent_length = int(marian_config['mini-batch-words'])
-    if '--max-length' in extra_args:
-        max_sent_length = int(
-            extra_args[extra_args.index('--max-length') + 1]
-        )
-    elif '--mini-batch-words' in extra_args and 'max-length' not in marian_config:
-        max_sent_length = int(
-            extra_args[extra_args.index('--mini-batch-words') + 1]
-        )
+    if '--max-length' in flags:
+        max_sent_length = int(extra_args[flags['--max-length'] + 1])
+    elif '--mini-batch-words' in flags and 'max-length' not in marian_config:
+        max_sent_length = int(extra_args[flags['--mini-batch-words'] + 1])
     if max_sent_length is None: #only if we didn't find it yet
         max_sent_length = settings['MAX_SENTENCE_LENGTH']
 
     #if the user selected to use n-best, set it to beam size for this model
     n_best = 1
-    if settings['NBEST'] or '--n-best' in extra_args: 
+    if settings['NBEST'] or '--n-best' in flags: 
         n_best = beam_size
     #if the user configured n-best but it's not in marian args yet, add it
-    if n_best > 1 and '--n-best' not in extra_args:
+    if n_best > 1 and '--n-best' not in flags:
         extra_args.append('--n-best')
 
     #find devices or fall back to using CPU
     devices = settings['DEVICES']
-    if devices and '--devices' not in extra_args:
+    if devices and '--devices' not in flags:
+        flags['--devices'] = len(extra_args)
         extra_args.append('--devices')
         if isinstance(devices, list):
             devices = ' '.join(devices)
         extra_args.append(devices)
-    elif '--devices' not in extra_args and '--cpu-threads' not in extra_args:
+    elif '--devices' not in flags and '--cpu-threads' not in flags:
         extra_args.append('--cpu-threads')
         extra_args.append(str(settings['CPU_COUNT']))
     #some users prefer '0,1,2,3' format, but marian only accepts '0 1 2 3'
-    if '--devices' in extra_args: 
-        idx = extra_args.index('--devices') + 1
-        devices = extra_args[idx]
-        devices.replace('"', '')
-        devices.replace("'", '')
-        devices = devices.replace(',', ' ')
-        extra_args[idx] = devices
+    if '--devices' in flags: 
+        idx = flags['--devices'] + 1
+        extra_args[idx] = str(extra_args[idx]).translate(_DEVICES_TABLE)
 
     extra_args = [str(x) for x in extra_args]
 
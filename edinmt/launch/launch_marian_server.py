@@ -5,19 +5,12 @@ Run an instance of the marian-server with settings set up from
 existing environment variables.
 """
 import argparse
-import asyncio
-import inspect
 import logging
-import multiprocessing
-import os
 import subprocess
 import sys
-import websockets
 from subprocess import PIPE
 from typing import *
 
-import yaml
-
 from edinmt import CONFIG
 from edinmt.get_settings import get_decoder_settings 
 
@@ -6,22 +6,23 @@ existing environment variables.
 """
 import argparse
 import asyncio
-import io
-import json
 import logging
 import os
 import sys
+from itertools import chain, repeat
 from typing import *
 
 import websockets 
 
 from edinmt import CONFIG
-from edinmt.get_settings import get_decoder_settings
+from edinmt.get_settings import get_decoder_settings_cached
 from edinmt.parse_marian import (
     parse, 
     parse_nbest_words, 
     unwrap_lines,
     fmt_item,
+    json_dumps,
+    json_loads,
 )
 from edinmt import retagger
 from edinmt.text_processors.text_processors import TextProcessor
@@ -36,6 +37,118 @@ port = CONFIG.PIPELINE_PORT
 host = CONFIG.PIPELINE_HOST
 use_query = CONFIG.QUERY
 max_length = CONFIG.MAX_SENTENCE_LENGTH
+max_batch_lines = CONFIG.PIPELINE_MAX_BATCH_LINES
+
+#one connection to the marian-server, reused by all requests; there's no
+#lock, since coalesce_marian_requests is its only user, one call at a time
+marian_ws = None
+
+async def translate_with_marian(src: str) -> str:
+    r"""
+    Send the src to the marian-server at `marian_url` and return its reply,
+    using a persistent connection (reconnecting if it was closed).
+    """
+    global marian_ws
+    for attempt in range(2):
+        if marian_ws is None or marian_ws.closed:
+            #websockets pings the connection every once in a while to check if
+            #it's still running but our marian server is silent for a long time
+            #while it works, which causes the connection to get closed with 1006
+            #so for this reason I set ping_timeout=None, but I'm not sure if this
+            #is the best way to solve this; see also:
+            #https://stackoverflow.com/questions/54101923/1006-connection-closed-abnormally-error-with-python-3-7-websockets
+            #https://websockets.readthedocs.io/en/stable/api.html#websockets.protocol.WebSocketCommonProtocol
+            marian_ws = await websockets.connect(
+                marian_url, ping_timeout=None, max_size=None)
+        try:
+            await marian_ws.send(src) 
+            return await marian_ws.recv()
+        except websockets.exceptions.ConnectionClosed:
+            #e.g. the marian-server restarted; try once more on a new one
+            marian_ws = None
+            if attempt:
+                raise
+
+#requests waiting for marian, which are coalesced into one marian call
+marian_queue = None
+
+async def translate_parsed(
+        src: str, n_lines: int, n_best: int, n_best_words: bool) -> list:
+    r"""
+    Queue the src (n_lines lines for marian) to be translated together with
+    those of any other concurrent requests, and return its parsed outputs.
+    """
+    global marian_queue
+    if marian_queue is None: #create it (and its consumer) in the running loop
+        marian_queue = asyncio.Queue()
+        asyncio.ensure_future(coalesce_marian_requests())
+    future = asyncio.get_event_loop().create_future()
+    await marian_queue.put((future, src, n_lines, (n_best, n_best_words)))
+    return await future
+
+async def coalesce_marian_requests():
+    r"""
+    Send everything that queued up while marian was busy as one request, so 
+    that marian can fill its mini-batches with sentences from all clients,
+    then parse the reply and split it back up between the waiting requests.
+    """
+    leftover = None
+    while True:
+        request = leftover or await marian_queue.get()
+        leftover = None
+        pending = [request]
+        n_lines = request[2]
+        #one malformed reply fails the whole batch, and the payload can't grow
+        #without bound, so take at most max_batch_lines (but always 1 request)
+        while not marian_queue.empty():
+            request = marian_queue.get_nowait()
+            if n_lines + request[2] > max_batch_lines:
+                leftover = request #it starts the next batch
+                break
+            pending.append(request)
+            n_lines += request[2]
+
+        #requests with different parse settings can't share one reply
+        groups = {}
+        for request in pending:
+            groups.setdefault(request[3], []).append(request)
+
+        for ((n_best, n_best_words), requests) in groups.items():
+            try:
+                src = '\n'.join(r_src for (_, r_src, _, _) in requests) + '\n'
+
+                #translate with marian
+                logger.debug(f"SEND: {src}")
+                response = await translate_with_marian(src)
+                logger.debug(f"RECV: {response}")
+
+                #parse the marian outputs (straight from the string, no re-encoding)
+                if n_best_words:
+                    parsed = parse_nbest_words(response, n_items=None, n_best=n_best)
+                else:
+                    parsed = parse(response, n_items=None, n_best=n_best)
+
+                #one parsed item per marian line, in the order they were sent,
+                #so if the count is off we can't tell whose lines are whose
+                total = sum(n_lines for (_, _, n_lines, _) in requests)
+                if len(parsed) != total:
+                    raise ValueError(
+                        f"ERROR: Sent {total} lines to marian but parsed "
+                        f"{len(parsed)} outputs; can't split the reply up "
+                        f"between {len(requests)} requests.")
+
+                start = 0
+                for (future, _, n_lines, _) in requests:
+                    end = start + n_lines
+                    if not future.done(): #e.g. the client went away
+                        future.set_result(parsed[start:end])
+                    start = end
+            except Exception as e:
+                #fail this group's requests, but keep consuming the queue
+                logger.error(f"{e}")
+                for (future, _, _, _) in requests:
+                    if not future.done():
+                        future.set_exception(e)
 
 #TODO I think we should convert to FastAPI for this, so we get all the
 #error handling and input/output parsing for free
@@ -51,14 +164,16 @@ async def server_func(ws, path):
     """
     async for input_batch in ws:
 
-        data = json.loads(input_batch)
+        data = json_loads(input_batch)
 
         #collect the metadata we need
         text = data['text']
         src_lang = data['src_lang']
         tgt_lang = data['tgt_lang']
 
-        decoder_settings = get_decoder_settings(src_lang, tgt_lang)
+        #the settings (incl. the loaded text processor) are the same for every
+        #request with the same langs, so only build them the first time
+        decoder_settings = get_decoder_settings_cached(src_lang, tgt_lang)
         tp = decoder_settings.text_processor
         warning = None
 
@@ -75,7 +190,7 @@ async def server_func(ws, path):
                         f"around them to equal the number of sentences.)"
                 logger.debug(f"{error}")
                 response = {'error': error} 
-                response = json.dumps(response, ensure_ascii=False, sort_keys=True)
+                response = json_dumps(response)
                 await ws.send(response)
                 continue
         elif 'query' in data:
@@ -83,17 +198,18 @@ async def server_func(ws, path):
                       f"by this model ({CONFIG.SYSTEM}). Query ignored." 
             logger.debug(f"{warning}")
 
-        #split long lines into multiple pieces; track original line ids
-        true_ids = []
         #find original empty lines to blank them out in case of hallucination
         empties = set()
         #extract urls, emails, xml tags to reisert in the output later 
         tagged = {}
-        j = 0
-        src = ""
+        #the non-empty lines (and their line ids) that need preprocessing
+        texts = []
+        text_ids = []
         for i, line in enumerate(lines):
             if not line:
+                #the output gets blanked out anyway, so don't preprocess it
                 empties.add(i)
+                continue
 
             if decoder_settings.extract_tags:
                 line, tags = retagger.extract_tags(line)
@@ -103,46 +219,40 @@ async def server_func(ws, path):
             #currently the query text processors accept tab-separated input
             if query:
                 line = f"{line}\t{query[i]}"
+            texts.append(line)
+            text_ids.append(i)
 
-            #wrap text and do remaining preprocessing (add multiling tags, etc)
-            proc, length = TextProcessor.wrap_text(
-                line, 
-                max_length, 
-                before_wrap=tp.preprocess_before_wrap,
-                after_wrap=tp.preprocess_after_wrap
-            )
-
-            logger.debug(f"{proc}")
-            if length > 1:
-                logger.debug(f"LONG LINE SPLIT INTO {length} PIECES: {line}") 
-
-            for k in range(length):
-                true_ids.append(j)
-            src += proc.strip() + '\n'
-            j += 1
-
-        #translate with marian
-        logger.debug(f"SEND: {src}")
-        #websockets pings the connection every once in a while to check if
-        #it's still running but our marian server is silent for a long time
-        #while it works, which causes the connection to get closed with 1006
-        #so for this reason I set ping_timeout=None, but I'm not sure if this
-        #is the best way to solve this; see also:
-        #https://stackoverflow.com/questions/54101923/1006-connection-closed-abnormally-error-with-python-3-7-websockets
-        #https://websockets.readthedocs.io/en/stable/api.html#websockets.protocol.WebSocketCommonProtocol
-        async with websockets.connect(marian_url, ping_timeout=None, max_size=None) as marian_ws:
-            await marian_ws.send(src) 
-            response = await marian_ws.recv()
-        logger.debug(f"RECV: {response}")
-
-        #parse the marian outputs
-        mtout = io.BytesIO(response.encode('utf-8'))
-        if decoder_settings.n_best_words:
-            parsed = parse_nbest_words(
-                mtout, n_items=None, n_best=decoder_settings.n_best)
-        else:
-            parsed = parse(
-                mtout, n_items=None, n_best=decoder_settings.n_best)
+        #wrap text and do remaining preprocessing (add multiling tags, etc),
+        #preprocessing all the lines at once (e.g. spm encodes a whole batch)
+        wrapped, wrapped_lengths = TextProcessor.wrap_texts(
+            texts, 
+            max_length, 
+            before_wrap_lines=tp.preprocess_before_wrap_lines,
+            after_wrap=tp.preprocess_after_wrap
+        )
+        #empty lines are still sent as (one) empty line, to keep the alignment
+        src_lines = [''] * len(lines)
+        lengths = [1] * len(lines)
+        for (i, proc, length) in zip(text_ids, wrapped, wrapped_lengths):
+            src_lines[i] = proc
+            lengths[i] = length
+
+        #split long lines into multiple pieces; track original line ids
+        #(wrap_texts already stripped the src_lines)
+        true_ids = list(chain.from_iterable(map(repeat, range(len(lengths)), lengths)))
+        if logger.isEnabledFor(logging.DEBUG):
+            for (j, length) in enumerate(lengths):
+                logger.debug(f"{src_lines[j]}")
+                if length > 1:
+                    logger.debug(f"LONG LINE SPLIT INTO {length} PIECES: {lines[j]}") 
+
+        #translate with marian, together with other clients' concurrent requests
+        parsed = await translate_parsed(
+            '\n'.join(src_lines), 
+            len(true_ids), 
+            decoder_settings.n_best, 
+            decoder_settings.n_best_words
+        )
         
         logger.debug(f"PARSED {parsed}")
 
@@ -1,11 +1,19 @@
 #!/usr/bin/env python3.7
 # -*- coding: utf-8 -*-
+import io
 import json
 import logging
 import os
+import re
+from itertools import groupby, islice
 from typing import *
 from typing import IO #the * above won't load this
 
+try:
+    import orjson #much faster json parser/serializer (see requirements.txt)
+except ImportError:
+    orjson = None
+
 from edinmt import CONFIG
 from edinmt import retagger
 from edinmt.text_processors import TextProcessor
@@ -16,6 +24,32 @@ logger.setLevel(CONFIG.LOG_LEVEL)
 handlers = logger.handlers.copy()
 logger.handlers = [h for h in handlers if not isinstance(h, logging.StreamHandler)]
 
+def _tee(lines, mtout):
+    r"""Write each line to mtout as it's read."""
+    for line in lines:
+        mtout.write(line)
+        yield line
+
+def _text_lines(process_stdout, mtout=None):
+    r"""
+    Iterate over the lines of process_stdout as strings (writing the raw 
+    lines to mtout, if given), deciding only once whether to decode them.
+    Lines are read one at a time, so the stream isn't read past what we use.
+    """
+    lines = iter(process_stdout)
+    if mtout:
+        lines = _tee(lines, mtout)
+    if isinstance(process_stdout, (io.RawIOBase, io.BufferedIOBase)):
+        lines = map(bytes.decode, lines) #utf-8
+    elif not isinstance(process_stdout, io.TextIOBase): #e.g. a list of lines
+        lines = (l.decode('utf-8') if isinstance(l, bytes) else l for l in lines)
+    return lines
+
+#the translation in a line of marian n-best output, which looks like:
+#"id ||| translation ||| F0 ||| score"
+_NBEST_TRANSLATION_RE = re.compile(
+    r'^[^\n]*? \|\|\| ([^\n]*?) \|\|\| [^\n]*? \|\|\| [^\n]*$', re.MULTILINE)
+
 def parse(
         process_stdout: IO, 
         n_items: Optional[int]=None, 
@@ -38,34 +72,50 @@ def parse(
 
     Returns:
         outputs: ordered list of dictionaries, one dict per translation item
+
+    NOTE: process_stdout may also be the whole marian output as one string
+    (e.g. a marian-server reply), which is parsed in one go with a regex.
     """
-    batch = []
+    if isinstance(process_stdout, str):
+        return _parse_str(process_stdout, n_items, n_best, mtout)
+    if n_best == 1:
+        return _parse_1best(process_stdout, n_items, mtout)
+
+    return list(iter_parse(process_stdout, n_items, n_best, mtout))
+
+def iter_parse(
+        process_stdout: IO, 
+        n_items: Optional[int]=None, 
+        n_best: Optional[int]=1,
+        mtout: Optional[IO]=None,
+    ):
+    r"""
+    Same as parse, but yields the items one at a time as they're read from 
+    process_stdout, so the whole output is never held in memory at once.
+    """
+    if isinstance(process_stdout, str):
+        yield from _parse_str(process_stdout, n_items, n_best, mtout)
+        return
+    if n_items == 0: #don't read any of the stream
+        return
+
     count = 0
     n_best_count = 0
     item = {}
 
     nbest_translations = []
-    for line in process_stdout:
-        if mtout:
-            mtout.write(line)
-
-        try:
-            decoded = line.decode('utf-8')
-        except AttributeError:
-            pass #it's already a string not bytes; no need to decode
-        else:
-            line = decoded
-
+    for line in _text_lines(process_stdout, mtout):
         n_best_count += 1 
         if ' ||| ' in line: #n-best marian
-            sent_id, translation, f0, score = line.split(' ||| ')
+            #"id ||| translation ||| F0 ||| score"; we only need the translation
+            translation = line.split(' ||| ', 2)[1]
             nbest_translations.append(translation)
             if n_best_count == n_best:
                 item = {
                     'id': count,
                     'translation': nbest_translations
                 }
-                batch.append(item) #FINISH ITEM
+                yield item #FINISH ITEM
                 nbest_translations = []
                 count += 1
                 n_best_count = 0
@@ -74,16 +124,57 @@ def parse(
                 'id': count,
                 "translation": [line], 
             }
-            batch.append(item) #FINISH ITEM
+            yield item #FINISH ITEM
             item = {}
             count += 1
         
         if count == n_items:
             break
-
-    return batch
         
 
+def _parse_1best(process_stdout, n_items=None, mtout=None):
+    r"""
+    Same as parse, but faster for the 1-best case, where every line is one
+    item, so we can take exactly n_items lines from the stream at once.
+    """
+    lines = list(islice(process_stdout, n_items))
+    if mtout:
+        mtout.writelines(lines)
+    if lines and isinstance(lines[0], bytes): #otherwise it's already a string
+        lines = [line.decode('utf-8') for line in lines]
+    return [
+        {
+            'id': i,
+            'translation': [line.split(' ||| ', 2)[1] if ' ||| ' in line else line]
+        }
+        for (i, line) in enumerate(lines)
+    ]
+
+def _parse_str(text, n_items=None, n_best=1, mtout=None):
+    r"""Same as parse, but for the whole marian output in one string."""
+    if mtout:
+        mtout.write(text)
+
+    if ' ||| ' in text: #n-best marian
+        translations = _NBEST_TRANSLATION_RE.findall(text)
+        count = len(translations) // n_best #an unfinished item is dropped
+        if n_items is not None:
+            count = min(count, n_items)
+        return [
+            {'id': i, 'translation': translations[i*n_best:(i+1)*n_best]}
+            for i in range(count)
+        ]
+
+    #normal marian; keep the newlines like iterating over a stream does
+    lines = text.split('\n')
+    last = lines.pop()
+    lines = [line + '\n' for line in lines]
+    if last:
+        lines.append(last)
+    if n_items is not None:
+        lines = lines[:n_items]
+    return [{'id': i, 'translation': [line]} for (i, line) in enumerate(lines)]
+
 def parse_nbest_words(
         process_stdout: IO, 
         n_items: Optional[int]=None, 
@@ -113,8 +204,74 @@ def parse_nbest_words(
 
     NOTE: n-best words decoder output available using Alham's decoder:
     https://github.com/afaji/Marian/tree/alt-words
+
+    NOTE: process_stdout may also be the whole marian output as one string
+    (e.g. a marian-server reply), which is parsed a whole block at a time.
     """
+    if isinstance(process_stdout, str):
+        return _parse_nbest_words_str(process_stdout, n_items, n_best, mtout)
+    return list(iter_parse_nbest_words(process_stdout, n_items, n_best, mtout))
+
+def _parse_nbest_words_str(text, n_items=None, n_best=1, mtout=None):
+    r"""
+    Same as parse_nbest_words, but for the whole marian output in one string;
+    each block of non-empty lines is one n-best translation, so we handle a
+    block at a time instead of stepping through the lines one by one.
+    """
+    if mtout:
+        mtout.write(text)
+    if n_items == 0:
+        return []
+
+    #lines like iterating over a stream gives, i.e. no extra one after a final \n
+    lines = text.split('\n')
+    if not lines[-1]:
+        lines.pop()
+
     batch = []
+    translation = []
+    nbest_words = []
+    blocks = [
+        list(block) 
+        for (nonempty, block) in groupby(map(str.strip, lines), key=bool)
+    ]
+    for (i, block) in enumerate(blocks):
+        if not block[0]: #empty lines between the blocks
+            continue
+        #the header lines, "id ||| sent ||| F0 ||| score", have no words
+        pairs = [line.partition('|||') for line in block if line.count(' ||| ') != 3]
+        transl = ''.join(token for (token, _, _) in pairs if token != '</s> ')
+        nbests = [rest.split() for (_, _, rest) in pairs]
+        #pairs of "word score", e.g. "the -1.9 it -3.2"
+        translation.append(transl.strip())
+        nbest_words.append([dict(zip(n[::2], n[1::2])) for n in nbests])
+
+        #like the stream, the last block is kept even if the n-best is short
+        if len(translation) == n_best or i == len(blocks) - 1:
+            batch.append({
+                'id': len(batch),
+                'translation': translation,
+                'nbest_words': nbest_words
+            })
+            translation = []
+            nbest_words = []
+            if len(batch) == n_items:
+                break
+    return batch
+
+def iter_parse_nbest_words(
+        process_stdout: IO, 
+        n_items: Optional[int]=None, 
+        n_best: Optional[int]=1,
+        mtout: Optional[IO]=None,
+    ):
+    r"""
+    Same as parse_nbest_words, but yields the items one at a time as they're 
+    read from process_stdout, so the whole output is never held in memory.
+    """
+    if n_items == 0: #don't read any of the stream
+        return
+
     count = 0
     n_best_count = 0
     parsing = False
@@ -123,33 +280,19 @@ def parse_nbest_words(
     nbestw = []
     translation = []
     nbest_words = []
-    for line in process_stdout:
-        if mtout:
-            mtout.write(line)
-
-        try:
-            decoded = line.decode('utf-8')
-        except AttributeError:
-            pass #it's already a string not bytes; no need to decode
-        else:
-            line = decoded
+    for line in _text_lines(process_stdout, mtout):
         line = line.strip()
 
         if line:
             parsing = True
-            try:
-                sent_id, sent, f0, score = line.split(' ||| ')
-            except ValueError:
-                token, rest = line.split('|||')
-                nbests = rest.split()
-                d = {}
-                for r in range(0, len(nbests), 2):
-                    d[nbests[r]] = nbests[r+1]
-                nbestw.append(d)
-                if token != '</s> ':
-                    transl += token
-            else:
+            if line.count(' ||| ') == 3: #"id ||| sent ||| F0 ||| score"
                 continue
+            token, _, rest = line.partition('|||')
+            nbests = rest.split()
+            #pairs of "word score", e.g. "the -1.9 it -3.2"
+            nbestw.append(dict(zip(nbests[::2], nbests[1::2])))
+            if token != '</s> ':
+                transl += token
 
         elif not line and parsing:
             translation.append(transl.strip())
@@ -164,7 +307,7 @@ def parse_nbest_words(
                     'translation': translation,
                     'nbest_words': nbest_words
                 }
-                batch.append(item) #FINISH ITEM
+                yield item #FINISH ITEM
                 translation = []
                 nbest_words = []
                 count += 1
@@ -184,9 +327,7 @@ def parse_nbest_words(
             'translation': translation,
             'nbest_words': nbest_words
         }
-        batch.append(item) #FINISH ITEM
-
-    return batch
+        yield item #FINISH ITEM
 
 def unwrap_lines(
         parsed: list,
@@ -219,80 +360,144 @@ def unwrap_lines(
     """
     final = []
 
-    collated = {}
+    #each true_id gets an index into the parallel lists below, in the order 
+    #the ids first appear (each item is a (translation, nbest_words) pair)
+    idxs = {}
+    translations = [] 
+    nbest_words = [] #None for items without nbest_words
     true_ids_iter = iter(true_ids)
-    last_true_id = 0
     
     #combine the split parsed item into one item with a list of split outputs
     #e.g. for a sentence with pieceN_topN we have a transformation of:
     #[p0_t1, p0_t2, p1_t1, p1_t1] -> [[p0_t1, p0_t2], [p1_t1, p1_t1]]
     for item in parsed:
         true_id = int(next(true_ids_iter))
-        if true_id not in collated:
-            collated[true_id] = {'id': true_id, 'translation': []}
-            if 'nbest_words' in item:
-                collated[true_id]['nbest_words'] = []
+        idx = idxs.setdefault(true_id, len(idxs))
+        if idx == len(translations): #first piece of this true_id
+            translations.append([])
+            nbest_words.append([] if 'nbest_words' in item else None)
 
-        collated[true_id]['translation'].append(item['translation'])
+        translations[idx].append(item['translation'])
         if 'nbest_words' in item:
-            collated[true_id]['nbest_words'].append(item['nbest_words'])
-        last_true_id = true_id
+            nbest_words[idx].append(item['nbest_words'])
 
-    #now combine the n-best sentences into one item, and also debpe, etc.
+    #now combine the n-best sentences into one item
     #e.g. for a sentence with pieceN_topN we have a transformation of:
     #[[p0_t1, p0_t2], [p1_t1, p1_t1]] -> [p0_t1_p1_t1, p0_t2_p1_t2]
-    for idx in collated:
-        item = collated[idx]
-        if empties and item['id'] in empties: #blank out hallucinations
-            item['translation'] = ['']*n_best
-            if 'nbest_words' in item:
-                item['nbest_words'] = [[]]*n_best
+    joined = []
+    for (true_id, idx) in idxs.items():
+        if empties and true_id in empties:
+            joined.append(None)
         else:
-            transl = list(zip(*item['translation']))
-            all_translations = []
-            for tup in transl:
-                translation = ' '.join([t.strip() for t in tup])
-                if text_processor:
-                    #debpe, detruecase, etc.
-                    translation = text_processor.postprocess(translation).strip()
-                    if tagged and item['id'] in tagged:
-                        tags = tagged[item['id']]
-                        #reinsert urls, emails, etc. that we had passed through
-                        translation = retagger.reinsert_tags(translation, tags)
-                all_translations.append(translation)
-            item['translation'] = all_translations
-
-            if 'nbest_words' in item:
-                nbestw = list(zip(*item['nbest_words']))
-                all_nbest_words = []
-                for tup in nbestw:
-                    nbest_words = []
-                    for l in tup:
-                        for i in l:
-                            nbest_words.append(i)
-                    all_nbest_words.append(nbest_words)
-                item['nbest_words'] = all_nbest_words
+            joined.append([
+                ' '.join(map(str.strip, tup)) 
+                for tup in zip(*translations[idx])
+            ])
+
+    #debpe, detruecase, etc. all the translations in one batch, so that the
+    #text processor can do it all at once (e.g. one detokenizer process)
+    if text_processor:
+        pending = [t for all_translations in joined if all_translations for t in all_translations]
+        processed = iter(text_processor.postprocess_lines(pending))
+        for all_translations in joined:
+            if all_translations:
+                for i in range(len(all_translations)):
+                    all_translations[i] = next(processed).strip()
+
+    for (true_id, idx) in idxs.items():
+        all_translations = joined[idx]
+        item_nbest_words = nbest_words[idx]
+        if all_translations is None: #blank out hallucinations
+            all_translations = ['']*n_best
+            if item_nbest_words is not None:
+                item_nbest_words = [[] for _ in range(n_best)]
+        else:
+            if text_processor and tagged and true_id in tagged:
+                tags = tagged[true_id]
+                #reinsert urls, emails, etc. that we had passed through
+                all_translations = [
+                    retagger.reinsert_tags(translation, tags) 
+                    for translation in all_translations
+                ]
+
+            if item_nbest_words is not None:
+                #flatten the pieces' n-best words for each n-best sentence
+                item_nbest_words = [
+                    [i for l in tup for i in l] 
+                    for tup in zip(*item_nbest_words)
+                ]
 
         #now separate the n-best sentences into their own separate json-lines
         #so we have json-line per n-best instead of n-bests inside 1 json
         if expand: 
-            for i in range(len(item['translation'])):
+            for i in range(len(all_translations)):
                 tmp_item = {
-                    'id': item['id'],
-                    'translation': item['translation'][i]
+                    'id': true_id,
+                    'translation': all_translations[i]
                 }
-                if 'nbest_words' in item:
-                    tmp_item['nbest_words'] = item['nbest_words'][i]
+                if item_nbest_words is not None:
+                    tmp_item['nbest_words'] = item_nbest_words[i]
                 final.append(tmp_item)
         else:
+            item = {'id': true_id, 'translation': all_translations}
+            if item_nbest_words is not None:
+                item['nbest_words'] = item_nbest_words
             final.append(item)
 
     return final 
 
+def iter_unwrap_lines(
+        parsed: Iterable[dict],
+        true_ids: list,
+        text_processor: Optional[TextProcessor]=None,
+        empties: Optional[set]=None,
+        tagged: Optional[dict]=None,
+        n_best: Optional[int]=1, 
+        expand: Optional[bool]=True,
+        batch_size: Optional[int]=1000,
+    ):
+    r"""
+    Same as unwrap_lines, but yields the final items, unwrapping about
+    batch_size parsed items at a time, so parsed can be a stream (e.g. from
+    iter_parse) and the whole output is never held in memory at once.
+
+    NOTE: the pieces of each original line must be consecutive in true_ids
+    (as preprocessing makes them), so that no line is split over batches.
+    """
+    batch = []
+    batch_ids = []
+    for (item, true_id) in zip(parsed, true_ids):
+        if len(batch) >= batch_size and true_id != batch_ids[-1]:
+            yield from unwrap_lines(
+                batch, batch_ids, text_processor, empties, tagged, n_best, expand
+            )
+            batch = []
+            batch_ids = []
+        batch.append(item)
+        batch_ids.append(true_id)
+    if batch:
+        yield from unwrap_lines(
+            batch, batch_ids, text_processor, empties, tagged, n_best, expand
+        )
+
+#same as json.loads, but much faster with orjson
+json_loads = orjson.loads if orjson else json.loads
+
+def json_dumps(obj) -> str:
+    r"""
+    Serialize obj as compact json-lines with sorted keys, using orjson (see
+    requirements.txt), e.g. {"id":0,"translation":"é"}. Without orjson, 
+    json.dumps gives the same separators, though floats may be written 
+    differently (e.g. 1e-05 vs orjson's 0.00001).
+    """
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
 def fmt_item(item, fmt):
     r"""Format the item to the correct output format (choices: CONFIG.FMTS)."""
     if fmt == 'json':
-        text = json.dumps(item, ensure_ascii=False, sort_keys=True)
+        text = json_dumps(item)
     elif fmt == 'marian':
         text = f"{item['id']} ||| {item['translation'].strip()}"
     elif fmt == 'text':
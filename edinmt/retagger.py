@@ -48,28 +48,34 @@ TWEET_TEMPL = ' [HANDLE{}] '
 #NOTE: To OR the regexes together the order matters, and above regexes
 #should be surrounded by non-capture groups, and it is recommended to
 #surround the pattern with spaces or non-word chars for best results.
-#full_regex = f"({TAG_REGEX})|({URL_REGEX})|({EMAIL_REGEX})|({TWEET_REGEX})"
-#REGEX = re.compile(full_regex)
-#TEMPL = (TAG_TEMPL, URL_TEMPL, EMAIL_TEMPL, TWEET_TEMPL) #same order as ORed regexes
+full_regex = f"({TAG_REGEX})|({URL_REGEX})|({EMAIL_REGEX})|({TWEET_REGEX})"
+REGEX = re.compile(full_regex)
+TEMPL = (TAG_TEMPL, URL_TEMPL, EMAIL_TEMPL, TWEET_TEMPL) #same order as ORed regexes
 
 def extract_tags(text: str):
     r"""
     Extract urls/emails/tags/etc from the text and return a tuple
     of the cleaned up text and a list of [(symbol, url/email/etc)].
     """
-    regexes = (TAG_REGEX, URL_REGEX, EMAIL_REGEX, TWEET_REGEX) 
-    templs = (TAG_TEMPL, URL_TEMPL, EMAIL_TEMPL, TWEET_TEMPL) 
-    for j, regex in enumerate(regexes):
-        matches = re.findall(regex, text)
-        tags = []
-        for i, match in enumerate(matches):
-            for j, m in enumerate(match):
-                if m:
-                    repl = templs[j].format(i)
-                    text = text.replace(m, repl, 1)
-                    tags.append([repl, m])
+    tags = []
+    counts = [0] * len(TEMPL) #each kind of tag is numbered separately
+
+    def _sub(match):
+        j = match.lastindex - 1 #which of the ORed regexes matched
+        repl = TEMPL[j].format(counts[j])
+        counts[j] += 1
+        tags.append([repl.strip(), match.group()])
+        return repl
+
+    #one left-to-right scan, replacing every match as we go
+    text = REGEX.sub(_sub, text)
     return text, tags 
 
+#matches any of the symbols made from the TEMPL above, e.g. [TAG0], [URL12]
+TAG_SYMBOL_REGEX = re.compile('|'.join(
+    re.escape(templ.strip()).replace(re.escape('{}'), r'\d+') for templ in TEMPL
+))
+
 def reinsert_tags(text: str, tags: List[tuple]):
     r"""
     Reinsert urls/emails/tags/etc. into the text using the list of
@@ -77,24 +83,34 @@ def reinsert_tags(text: str, tags: List[tuple]):
     the symbols into the output, the url/email will just be
     appended to the end of the text.
     """
-    for tag, item in tags:
-        tag = tag.strip()
-        if tag in text:
-            text = text.replace(tag, item, 1)
-        else:
-            #MT didn't output it, but we don't want to lose it
-            text = f"{text} {item}"
+    items = {tag.strip(): item for (tag, item) in tags}
+    missing = dict.fromkeys(items) #ordered, so they're appended in order
+
+    def _sub(match):
+        symbol = match.group()
+        if symbol in missing: #only the first occurrence of each symbol
+            del missing[symbol]
+            return items[symbol]
+        return symbol
+
+    #one left-to-right scan, replacing every symbol as we go
+    text = TAG_SYMBOL_REGEX.sub(_sub, text)
+    for symbol in missing:
+        #MT didn't output it, but we don't want to lose it
+        text = f"{text} {items[symbol]}"
     return text
 
+_dump_tags = json.JSONEncoder().encode #same as json.dumps, built only once
+
 def extract_tags_file(input_fp: str, output_fp: str, tags_fp: str):
     with open(input_fp, 'r', encoding='utf-8') as infile, \
          open(output_fp, 'w', encoding='utf-8') as outfile, \
          open(tags_fp, 'w', encoding='utf-8') as tags_fh:
-        for i, line in enumerate(infile):
-            line = line.strip()
-            line, tags = extract_tags(line)
+        for line in infile:
+            line, tags = extract_tags(line.strip())
             outfile.write(line + '\n')
-            tags_fh.write(json.dumps(tags) + '\n')
+            #most lines have nothing to pass through
+            tags_fh.write(_dump_tags(tags) + '\n' if tags else '[]\n')
     return output_fp, tags_fp
 
 def reinsert_tags_file(input_fp: str, tags_fp: str, output_fp: str):
@@ -5,30 +5,65 @@ Implement a simple plugin architecture, by loading all submodule classes
 into the globals of this package. 
 Plugins must iherit from `edinmt.scorers.Scorer`. 
 
+Any module dropped into this directory is scanned for plugins, and plugins
+from other installed packages can also be registered as 'edinmt.scorers'
+entry points (see setup.py). Discovery happens lazily, the first time 
+SCORERS (or a plugin by name) is looked up, so importing this package alone
+doesn't import every submodule.
+
 Acknowledgements: https://julienharbulot.com/python-dynamical-import.html
 """
 from inspect import isclass
+from itertools import chain
 from pkgutil import iter_modules
 from pathlib import Path
 from importlib import import_module
 
 from .scorers import Scorer
 
-SCORERS = {}
+ENTRY_POINT_GROUP = 'edinmt.scorers'
 
-# iterate through the modules in the current package
-package_dir = str(Path(__file__).resolve().parent)
-for (_, module_name, _) in iter_modules([package_dir]):
+def _entry_points():
+    r"""The installed entry points for our scorer plugins (maybe none)."""
+    try:
+        from importlib.metadata import entry_points
+    except ImportError: #python < 3.8
+        return []
+    eps = entry_points()
+    if hasattr(eps, 'select'): #python >= 3.10
+        return eps.select(group=ENTRY_POINT_GROUP)
+    return eps.get(ENTRY_POINT_GROUP, [])
 
-    # import the module and iterate through its attributes
-    module = import_module(f"{__name__}.{module_name}")
-    for attribute_name in dir(module):
+def _scan_modules():
+    r"""Import every submodule of this package and yield all its Scorers."""
+    package_dir = str(Path(__file__).resolve().parent)
+    for (_, module_name, _) in iter_modules([package_dir]):
+        module = import_module(f"{__name__}.{module_name}")
+        for attribute_name in dir(module):
             attribute = getattr(module, attribute_name)
-
-            #gather just Scorers and add to importable globals (for *)
             if isclass(attribute) and issubclass(attribute, Scorer):
-                globals()[attribute_name] = attribute
+                yield attribute
+
+def _discover():
+    r"""Gather the Scorers into the plugin dict and the importable globals."""
+    scorers = {Scorer.__name__: Scorer}
+    #the entry points are added on top of the scan, not instead of it, so a
+    #new module in this directory is found without reinstalling edinmt
+    plugins = chain(_scan_modules(), (ep.load() for ep in _entry_points()))
+    for plugin in plugins:
+        #also add Scorers to plugin dict, so they can 
+        #be easier to reference by name in edinmt.translate
+        scorers[plugin.__name__] = plugin
+    globals().update(scorers)
+    globals()['SCORERS'] = scorers
+    return scorers
 
-                #also add Scorers to plugin dict, so they can 
-                #be easier to reference by name in edinmt.translate
-                SCORERS[attribute.__name__] = attribute
+def __getattr__(name):
+    #only called for names not found yet, i.e. before discovery has run
+    if name == 'SCORERS':
+        return _discover()
+    if name.startswith('__'):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if 'SCORERS' not in globals() and name in _discover():
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
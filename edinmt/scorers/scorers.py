@@ -1,8 +1,9 @@
 import logging
 import re
-import subprocess
 from abc import ABC, abstractmethod
 
+import sacrebleu
+
 from edinmt import CONFIG 
 from edinmt.configs.config import all_members
 
@@ -11,6 +12,15 @@ logger = logging.getLogger('edinmt.scorers.scorers')
 logger.setLevel(CONFIG.LOG_LEVEL)
 
 
+def read_lines(fp):
+    r"""
+    Read the lines of the file, split only on \n (like sacrebleu's own reader,
+    so a stray \r or other line break char doesn't change the line count).
+    """
+    with open(fp, 'r', encoding='utf-8', newline='\n') as infile:
+        return [line.rstrip('\n') for line in infile]
+
+
 class Scorer(ABC):
     def __init__(self, **kwargs):
         #set up the attributes from the CONFIG, e.g. SYSTEMS_DIR, etc.
@@ -35,14 +45,16 @@ class SacrebleuScorer(Scorer):
         super().__init__(**kwargs)
 
     def score_file(self, pred_fp, ref_fp):
-        if isinstance(ref_fp, list):
-            ref_fp = ' '.join(ref_fp)
-        cmd = f'cat {pred_fp} | sacrebleu {ref_fp}'
-        logger.debug('RUNNING: ' + cmd)
-        result = subprocess.check_output(cmd, shell=True)
-        result = result.decode()
+        if not isinstance(ref_fp, list):
+            ref_fp = [ref_fp]
+        logger.debug(f"SACREBLEU: {pred_fp} -VS- {ref_fp}")
+        result = sacrebleu.corpus_bleu(
+            read_lines(pred_fp), 
+            [read_lines(fp) for fp in ref_fp]
+        )
         logger.debug(f"SACREBLEU RESULT: {result}")
-        bleu = result.split(" = ")[1].split(" ")[0]
+        #same as the sacrebleu command line prints it (1 decimal)
+        bleu = f"{result.score:.1f}"
         return bleu 
 
 class QueryScorer(Scorer):
@@ -58,9 +70,10 @@ class QueryScorer(Scorer):
         total_metric = 0
         with open(pred_fp, 'r', encoding='utf-8') as pred_fh, \
              open(query_fp, 'r', encoding='utf-8') as query_fh:
-            for line in pred_fh:
+            #(a missing query line is the same as an empty one, so zip is fine)
+            for (line, terms) in zip(pred_fh, query_fh):
                     target = line.strip()
-                    terms = query_fh.readline().strip()
+                    terms = terms.strip()
                     if not terms:
                         continue
                     terms = terms.split('|||')
@@ -68,7 +81,7 @@ class QueryScorer(Scorer):
 
                     #count this sentence's total
                     expected_terms = len(terms)
-                    inserted_terms = sum([target.count(term.strip()) for term in terms])
+                    inserted_terms = sum(map(target.count, map(str.strip, terms)))
 
                     metric = abs(inserted_terms - expected_terms) / expected_terms
                     total_metric += 1 - metric
@@ -1,3 +1,6 @@
+import os
+import shutil
+
 from edinmt import setup_logger
 from edinmt.configs.config import TestConfig
 
@@ -6,4 +9,33 @@ TEST_LOGGER = setup_logger(
     name="edinmt.tests", 
     level=TestConfig.LOG_LEVEL, 
     to_stdout=True
-)
\ No newline at end of file
+)
+
+def link_or_copy(src, dst):
+    r"""
+    Hard link the (read-only) test input to dst instead of copying its bytes;
+    fall back to a plain copy if dst is on another filesystem, etc.
+    """
+    if os.path.lexists(dst): #left over from an earlier run without PURGE
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    return dst
+
+def walk_files(path, exclude=()):
+    r"""
+    Yield the paths of all files under path, recursively, without descending
+    into dirs named in exclude (e.g. 'tmp'); os.scandir's entries already
+    know their type, so this needs no extra stat calls.
+    """
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir():
+                    if not entry.is_symlink() and entry.name not in exclude:
+                        stack.append(entry.path)
+                else:
+                    yield entry.path
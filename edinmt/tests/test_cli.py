@@ -7,7 +7,9 @@ import unittest
 from unittest import mock
 
 from edinmt.configs.config import TestConfig
+from edinmt.tests import link_or_copy, walk_files
 from edinmt.cli import translate_folder, translate_input
+from edinmt.parse_marian import fmt_item, json_loads
 
 #be explicit so logging occurs correctly even if this is run as main
 logger = logging.getLogger('edinmt.tests.test_cli')
@@ -19,37 +21,34 @@ PLAYGROUND_DIR = os.path.join(TestConfig.ROOT_DIR, "edinmt", "tests", "data", "p
 
 class TestTranslateFolder(unittest.TestCase):
     maxDiff = None
+    names = ['txt.0', 'txt.1', 'txt.2', os.path.join('subfolder', 'txt.3')]
 
-    def setUp(self):
+    @classmethod
+    def setUpClass(cls):
         r"""
         Make a fake directory structure for testing purposes, which will be
-        deleted at the end of the test.
+        deleted at the end of the tests, and translate it just once (loading
+        the model is the expensive part); only the formatting differs between
+        fmts, so the marian/text outputs are made from the json output.
         """
-        self.name = self.id().split('.')[-1]
-        self.translate_me_dir = os.path.join(PLAYGROUND_DIR, self.name, 'translate_me')
-        self.mtout_dir = os.path.join(PLAYGROUND_DIR, self.name, 'mtout')
-        os.makedirs(self.mtout_dir, exist_ok=True)
-        os.makedirs(self.translate_me_dir, exist_ok=True)
-        os.makedirs(os.path.join(self.translate_me_dir, 'subfolder'), exist_ok=True)
+        cls.name = cls.__name__
+        cls.translate_me_dir = os.path.join(PLAYGROUND_DIR, cls.name, 'translate_me')
+        cls.mtout_dir = os.path.join(PLAYGROUND_DIR, cls.name, 'mtout')
+        os.makedirs(cls.translate_me_dir, exist_ok=True)
+        os.makedirs(os.path.join(cls.translate_me_dir, 'subfolder'), exist_ok=True)
         for i in range(3):
-            shutil.copy(TEST_FILE, os.path.join(self.translate_me_dir, f'txt.{i}'))
-        shutil.copy(TEST_FILE, os.path.join(self.translate_me_dir, os.path.join('subfolder', f'txt.3')))
+            link_or_copy(TEST_FILE, os.path.join(cls.translate_me_dir, f'txt.{i}'))
+        link_or_copy(TEST_FILE, os.path.join(cls.translate_me_dir, os.path.join('subfolder', f'txt.3')))
 
-    def tearDown(self):
-        r"""
-        Completely delete the entire contents of the testing directory 
-        that we created in setUp.
-        """
-        if TestConfig.PURGE:
-            shutil.rmtree(self.translate_me_dir)
-            shutil.rmtree(self.mtout_dir)
+        cls.mtout_dirs = {fmt: os.path.join(cls.mtout_dir, fmt) for fmt in TestConfig.FMTS}
+        for mtout_dir in cls.mtout_dirs.values():
+            os.makedirs(mtout_dir, exist_ok=True)
 
-    def test_cli_translate_folder_fast_1best_fmt_json(self):
         translate_folder.main(
             src_lang='fa',
             tgt_lang='en',
-            input_dir=self.translate_me_dir, 
-            output_dir=self.mtout_dir,
+            input_dir=cls.translate_me_dir, 
+            output_dir=cls.mtout_dirs['json'],
             system_name='faen',
             use_mode='fast',
             n_best=False,
@@ -57,84 +56,67 @@ class TestTranslateFolder(unittest.TestCase):
             fmt='json',
         )
 
-        result = set([os.path.join(dp, f) for dp, dn, fn in os.walk(self.mtout_dir) for f in fn])
-        answer = set([
-            f'{self.mtout_dir}/txt.0', 
-            f'{self.mtout_dir}/txt.1', 
-            f'{self.mtout_dir}/txt.2', 
-            f'{self.mtout_dir}/subfolder/txt.3', 
-        ])
+        for fmt in ['marian', 'text']:
+            for name in cls.names:
+                json_fp = os.path.join(cls.mtout_dirs['json'], name)
+                fmt_fp = os.path.join(cls.mtout_dirs[fmt], name)
+                os.makedirs(os.path.dirname(fmt_fp), exist_ok=True)
+                with open(json_fp, 'r', encoding='utf-8') as infile, \
+                     open(fmt_fp, 'w', encoding='utf-8') as outfile:
+                    for line in infile:
+                        outfile.write(fmt_item(json_loads(line), fmt) + '\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        r"""
+        Completely delete the entire contents of the testing directory 
+        that we created in setUpClass.
+        """
+        if TestConfig.PURGE:
+            shutil.rmtree(cls.translate_me_dir)
+            shutil.rmtree(cls.mtout_dir)
+
+    def check_output_files(self, mtout_dir):
+        r"""Check the fmt's output dir mirrors the input dir."""
+        result = set(walk_files(mtout_dir))
+        answer = set(os.path.join(mtout_dir, name) for name in self.names)
+        self.assertEqual(answer, result)
 
-        for name in ['txt.0', 'txt.1', 'txt.2', os.path.join('subfolder', 'txt.3')]:
-            with open(os.path.join(self.mtout_dir, name), 'r', encoding='utf-8') as fh:
+    def test_cli_translate_folder_fast_1best_fmt_json(self):
+        mtout_dir = self.mtout_dirs['json']
+        for name in self.names:
+            with open(os.path.join(mtout_dir, name), 'r', encoding='utf-8') as fh:
                 data = fh.readlines()
                 self.assertEqual(len(data), 100)
-                self.assertEqual(json.loads(data[0])['id'], 0)
-                self.assertEqual(json.loads(data[99])['id'], 99)
+                first = json_loads(data[0])
+                last = json_loads(data[99])
+                self.assertEqual(first['id'], 0)
+                self.assertEqual(last['id'], 99)
                 self.assertTrue('|||' not in data[0])
 
-        self.assertEqual(answer, result)
-
+        self.check_output_files(mtout_dir)
 
     def test_cli_translate_folder_fast_1best_fmt_marian(self):
-        translate_folder.main(
-            src_lang='fa',
-            tgt_lang='en',
-            input_dir=self.translate_me_dir, 
-            output_dir=self.mtout_dir,
-            use_mode='fast',
-            system_name='faen',
-            n_best=False,
-            n_best_words=False,
-            fmt='marian',
-        )
-
-        result = set([os.path.join(dp, f) for dp, dn, fn in os.walk(self.mtout_dir) for f in fn])
-        answer = set([
-            f'{self.mtout_dir}/txt.0', 
-            f'{self.mtout_dir}/txt.1', 
-            f'{self.mtout_dir}/txt.2', 
-            f'{self.mtout_dir}/subfolder/txt.3', 
-        ])
-
-        for name in ['txt.0', 'txt.1', 'txt.2', os.path.join('subfolder', 'txt.3')]:
-            with open(os.path.join(self.mtout_dir, name), 'r', encoding='utf-8') as fh:
+        mtout_dir = self.mtout_dirs['marian']
+        for name in self.names:
+            with open(os.path.join(mtout_dir, name), 'r', encoding='utf-8') as fh:
                 data = fh.readlines()
                 self.assertEqual(len(data), 100)
                 self.assertEqual(data[0].split(' ||| ')[0], '0')
                 self.assertEqual(data[99].split(' ||| ')[0], '99')
 
-        self.assertEqual(answer, result)
+        self.check_output_files(mtout_dir)
 
     def test_cli_translate_folder_fast_1best_fmt_text(self):
-        translate_folder.main(
-            src_lang='fa',
-            tgt_lang='en',
-            input_dir=self.translate_me_dir, 
-            output_dir=self.mtout_dir,
-            use_mode='fast',
-            system_name='faen',
-            n_best=False,
-            n_best_words=False,
-            fmt='text',
-        )
-
-        result = set([os.path.join(dp, f) for dp, dn, fn in os.walk(self.mtout_dir) for f in fn])
-        answer = set([
-            f'{self.mtout_dir}/txt.0', 
-            f'{self.mtout_dir}/txt.1', 
-            f'{self.mtout_dir}/txt.2', 
-            f'{self.mtout_dir}/subfolder/txt.3', 
-        ])
-
-        for name in ['txt.0', 'txt.1', 'txt.2', os.path.join('subfolder', 'txt.3')]:
-            with open(os.path.join(self.mtout_dir, name), 'r', encoding='utf-8') as fh:
+        mtout_dir = self.mtout_dirs['text']
+        for name in self.names:
+            with open(os.path.join(mtout_dir, name), 'r', encoding='utf-8') as fh:
                 data = fh.readlines()
                 self.assertEqual(len(data), 100)
-                self.assertRaises(json.JSONDecodeError, json.loads, s=data[0])
+                self.assertRaises(json.JSONDecodeError, json_loads, data[0])
                 self.assertTrue('|||' not in data[0])
 
-        self.assertEqual(answer, result)
+        self.check_output_files(mtout_dir)
 
 
 
@@ -1,238 +1,188 @@
+import functools
 import io
 import json
 import logging
+import os
 import unittest
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from edinmt.configs.config import TestConfig
 from edinmt import translate_input
-from edinmt.get_settings import get_decoder_settings 
+from edinmt.parse_marian import fmt_item
+from edinmt.get_settings import get_decoder_settings_cached
 
 #be explicit so logging occurs correctly even if this is run as main
 logger = logging.getLogger('edinmt.tests.test_langs')
 logger.setLevel(TestConfig.LOG_LEVEL)
 
-#This is where we can add more language direction tests
+#This is where we can add more language direction tests: one record per
+#direction in the json file, with the same fields as the LangTest below
+LANG_TESTS_FILE = os.path.join(TestConfig.ROOT_DIR, "edinmt", "tests", "data", "lang_tests.json")
 LangTest = namedtuple('LangTest', ['system', 'src_lang', 'tgt_lang', 'src_txt', 'tgt_txt'])
-lang_tests = [
-    LangTest('kaen', 'ka', 'en', 
-        'ნს, რამ თდპსქკთ.',
-        'My daughter is dead.'
-    ),
-    LangTest('enka', 'en', 'ka', 
-        'My daughter is dead.',
-        'ნს, რამ თდპსქკთ.'
-    ),
-    LangTest('kaen_query', 'ka', 'en', 
-        'ნს, რამ თდპსქკთ. ||| daughter',
-        'My daughter is dead.'
-    ),
-    LangTest('kken_query', 'kk', 'en', 
-        'Ақша-несие саясатының сценарийін қайта жазсақ ||| policy\n'\
-        'Бірақ бұл тұжырымды жоққа шығаратын себептер жеткілікті ||| the reasons.',
-        "Performance of monetary policy\n"\
-        "But the reasons that dissolve this concept are sufficient."
-    ),
-    LangTest('kken', 'kk', 'en', 
-        'Ақша-несие саясатының сценарийін қайта жазсақ\n'\
-        'Бірақ бұл тұжырымды жоққа шығаратын себептер жеткілікті.',
-        "Performance of monetary policy\n"\
-        "But the reasons that dissolve this concept are sufficient."
-    ),
-    LangTest('enkk', 'en', 'kk', 
-        "Performance of monetary policy\n"\
-        "But the reasons that dissolve this concept are sufficient.",
-        'Ақша-несие саясатының сценарийін қайта жазсақ\n'\
-        'Бірақ бұл тұжырымды жоққа шығаратын себептер жеткілікті.'
-
-    ),
-    LangTest('kkenru', 'kk', 'en', 
-        'Ақша-несие саясатының сценарийін қайта жазсақ\n'\
-        'Бірақ бұл тұжырымды жоққа шығаратын себептер жеткілікті.',
-        "Performance of monetary policy\n"\
-        "But the reasons that dissolve this concept are sufficient."
-    ),
-    LangTest('kkenru', 'en', 'kk', 
-        "Performance of monetary policy\n"\
-        "But the reasons that dissolve this concept are sufficient.",
-        'Ақша-несие саясатының сценарийін қайта жазсақ\n'\
-        'Бірақ бұл тұжырымды жоққа шығаратын себептер жеткілікті.'
-
-    ),
-    LangTest('faen', 'fa', 'en', 
-        'ما در "برکلی بایونیکس" به این روبات‌‌ها اگزو اسکلت می‌گوئیم.\n'\
-        'ما در "برکلی بایونیکس" به این روبات‌‌ها اگزو اسکلت می‌گوئیم.',
-        "In Berkeley, we call these robots Exoskeleton.\n"
-        "In Berkeley, we call these robots Exoskeleton."
-    ),
-    LangTest('enfa', 'en', 'fa', 
-        "In Berkeley, we call these robots Exoskeleton.\n"
-        "In Berkeley, we call these robots Exoskeleton.",
-        'ما در "برکلی بایونیکس" به این روبات‌‌ها اگزو اسکلت می‌گوئیم.\n'\
-        'ما در "برکلی بایونیکس" به این روبات‌‌ها اگزو اسکلت می‌گوئیم.',
-    ),
-    LangTest('bgen', 'bg', 'en',
-        'iтова е тест.',
-        'This is a test.',
-    ),
-    LangTest('enbg', 'en', 'bg',
-        'This is a test.',
-        'iтова е тест.',
-    ),
-    LangTest('lten', 'lt', 'en',
-        'Čia testas.',
-        'This is a test',
-    ),
-    LangTest('enlt', 'en', 'lt',
-        'This is a test',
-        'Čia testas.',
-    ),
-    LangTest('soen', 'so', 'en',
-        'Tani waa tijaabo.',
-        'This is a test',
-    ),
-    LangTest('enso', 'en', 'so',
-        'This is a test',
-        'Tani waa tijaabo.',
-    ),
-    LangTest('swen', 'sw', 'en',
-        'Huu ni mtihani.',
-        'This is a test',
-    ),
-    LangTest('ensw', 'en', 'sw',
-        'This is a test',
-        'Huu ni mtihani.',
-    ),
-    LangTest('tlen', 'tl', 'en',
-        'Ito ay isang pagsubok.',
-        'This is a test',
-    ),
-    LangTest('entl', 'en', 'tl',
-        'This is a test',
-        'Ito ay isang pagsubok.',
-    ),
-    LangTest('psen', 'ps', 'en',
-        'ﺩﺍ ﺍﺰﻣﻭیﻦﻫ ﺪﻫ.',
-        'This is a test',
-    ),
-    LangTest('enps', 'en', 'ps',
-        'This is a test',
-        'ﺩﺍ ﺍﺰﻣﻭیﻦﻫ ﺪﻫ.',
-    ),
-]
-
-def translation_test(lang_test, user_settings):
-    decoder_settings = get_decoder_settings(
-        lang_test.src_lang, lang_test.tgt_lang, 
-        config=TestConfig, user_settings=user_settings)
-
-    input_fh = io.StringIO(lang_test.src_txt) 
-    output_fh = io.StringIO()
+
+@functools.lru_cache(maxsize=None)
+def load_lang_tests():
+    r"""Read the LangTests from the LANG_TESTS_FILE (just once)."""
+    with open(LANG_TESTS_FILE, 'r', encoding='utf-8') as infile:
+        return tuple(LangTest(**record) for record in json.load(infile))
+
+#{(decoder key, src_txt): (returncode, items)}; shared between the test
+#methods, since many of their tests resolve to the same decoder settings
+_TRANSLATED = {}
+
+def _decoder_key(lang_test, decoder_settings):
+    r"""Tests with equal keys are translated exactly the same way."""
+    return (
+        lang_test.src_lang, 
+        lang_test.tgt_lang, 
+        tuple(decoder_settings.cmd), 
+        type(decoder_settings.text_processor).__name__,
+        decoder_settings.n_best, 
+        decoder_settings.n_best_words, 
+        decoder_settings.fmt,
+    )
+
+def translate_batch(tests):
+    r"""
+    Translate the (lang_test, user_settings) tests, running the decoder just
+    once for each group of tests that resolve to the same decoder settings
+    (loading the model is the expensive part), instead of once per test, 
+    and reusing translations already made for earlier tests.
+    Returns a (success, mtout, cmd) for each of the tests, in order.
+    """
+    settings = []
+    groups = {}
+    for (i, (lang_test, user_settings)) in enumerate(tests):
+        decoder_settings = get_decoder_settings_cached(
+            lang_test.src_lang, lang_test.tgt_lang, 
+            config=TestConfig, user_settings=user_settings)
+        key = _decoder_key(lang_test, decoder_settings)
+        settings.append((key, decoder_settings))
+        if (key, lang_test.src_txt) not in _TRANSLATED:
+            groups.setdefault(key, []).append(i)
+
+    #the groups use different models, so they can be translated in parallel
+    jobs = []
+    for (key, indices) in groups.items():
+        decoder_settings = settings[indices[0]][1]
+        src_txts = list(dict.fromkeys(tests[i][0].src_txt for i in indices))
+        jobs.append((key, decoder_settings, src_txts))
+    #groups that only differ in direction (e.g. the multilingual kkenru's
+    #kk->en and en->kk) load the same model, so run them back to back while
+    #it's still in the page cache; the cmd holds the model's config path
+    jobs.sort(key=lambda job: job[0][2])
+    with ThreadPoolExecutor(max_workers=TestConfig.TEST_WORKERS) as executor:
+        outputs = executor.map(lambda job: translate_group(*job[1:]), jobs)
+        for ((key, _, src_txts), (returncode, records)) in zip(jobs, outputs):
+            #split the output back up between the tests, by their number of lines
+            offset = 0
+            for src_txt in src_txts:
+                n_lines = len(src_txt.split('\n'))
+                #renumber the ids as if src_txt were translated on its own
+                items = [
+                    dict(item, id=item['id'] - offset) 
+                    for item in records[offset:offset + n_lines]
+                ]
+                _TRANSLATED[(key, src_txt)] = (returncode, items)
+                offset += n_lines
+
+    results = []
+    for ((lang_test, _), (key, decoder_settings)) in zip(tests, settings):
+        returncode, items = _TRANSLATED[(key, lang_test.src_txt)]
+        mtout = ''.join(fmt_item(item, decoder_settings.fmt) + '\n' for item in items)
+        success = translation_ok(lang_test, returncode, items)
+        results.append((success, mtout, decoder_settings.cmd))
+    return results
+
+def translate_group(decoder_settings, src_txts):
+    r"""Translate the src_txts in one decoder run; return its output items."""
+    input_fh = io.StringIO('\n'.join(src_txts)) 
+    records = []
 
     returncode = translate_input.translate(
         subcommand=decoder_settings.cmd,
         input_fh=input_fh,
-        output_fh=output_fh,
         text_processor=decoder_settings.text_processor, 
         n_best=decoder_settings.n_best,
         n_best_words=decoder_settings.n_best_words,
-        fmt=decoder_settings.fmt
+        fmt=decoder_settings.fmt,
+        records=records,
     )
+    return returncode, records
 
-    output_fh.seek(0)
-    mtout = output_fh.read()
-    data = mtout.split('\n')
-
+def translation_ok(lang_test, returncode, items):
+    r"""Check the output items translated from lang_test.src_txt."""
     try:
         assert returncode == 0
-        #add 1 because of final \n at end of mt output
-        assert len(data) == len(lang_test.tgt_txt.split('\n'))+1
-        assert json.loads(data[0])['id'] == 0
-        assert '|||' not in data[0]
-    except AssertionError:
-        return False, mtout, decoder_settings.cmd
+        assert len(items) == len(lang_test.tgt_txt.split('\n'))
+        assert items[0]['id'] == 0
+        assert '|||' not in items[0]['translation']
+    except (AssertionError, IndexError, KeyError):
+        return False
     else:
-        return True, mtout, decoder_settings.cmd
+        return True
 
 
 class TestSystems(unittest.TestCase):
 
+    def log_results(self, results, name):
+        r"""Log the outputs, so we can make sure they look correct."""
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        #print the failures second so they're more salient
+        for (success, tag) in ((True, 'SUCCESS'), (False, '***FAIL***')):
+            for lang_test, mtout, cmd in results[success]:
+                logger.info(
+                    "%s: %s %s2%s: %s\nSRC:\n%s\nREF:\n%s\nOUT:\n%s\n",
+                    tag, lang_test.system, lang_test.src_lang, lang_test.tgt_lang, 
+                    ' '.join(cmd), lang_test.src_txt, lang_test.tgt_txt, mtout
+                )
+        if results[False]:
+            logger.info('FAILED %s: %s', name, [item[0].system for item in results[False]])
+
     def test_langs(self):
         results = {True: [], False: []}
 
-        for lang_test in lang_tests:
+        tests = []
+        for lang_test in load_lang_tests():
             user_settings = dict(
                 MODE='fast', 
                 NBEST_WORDS=False,
                 NBEST=False,
                 FMT='json',
-                CPU_COUNT=1, #we test 1 line at a time, so just load model quickly
+                CPU_COUNT=1, #we test only a few lines, so just load model quickly
                 SYSTEM=lang_test.system,
             )
-            success, mtout, cmd = translation_test(lang_test, user_settings)
+            tests.append((lang_test, user_settings))
+
+        for ((lang_test, _), (success, mtout, cmd)) in zip(tests, translate_batch(tests)):
             results[success].append( (lang_test, mtout, cmd) )
 
-        #print outputs so we can make sure it looks correct
-        for lang_test, mtout, cmd in results[True]:
-            msg = f"SUCCESS: {lang_test.system} "\
-                  f"{lang_test.src_lang}2{lang_test.tgt_lang}: "\
-                  f"{' '.join(cmd)}\n"\
-                  f"SRC:\n{lang_test.src_txt}\n"\
-                  f"REF:\n{lang_test.tgt_txt}\n"\
-                  f"OUT:\n{mtout}\n"
-            logger.info(msg)
-        #print the failures second so they're more salient
-        for lang_test, mtout, cmd in results[False]: 
-            msg = f"***FAIL***: {lang_test.system} "\
-                  f"{lang_test.src_lang}2{lang_test.tgt_lang}: "\
-                  f"{' '.join(cmd)}\n"\
-                  f"SRC:\n{lang_test.src_txt}\n"\
-                  f"REF:\n{lang_test.tgt_txt}\n"\
-                  f"OUT:\n{mtout}\n"
-            logger.info(msg)
-        
-        if results[False]:
-            logger.info(f'FAILED test_langs: {[item[0].system for item in results[False]]}')
-            
+        self.log_results(results, 'test_langs')
+
         #assert we have no failures 
         self.assertFalse(results[False])
 
     def test_langs_no_system(self):
         results = {True: [], False: []}
 
-        for lang_test in lang_tests:
+        tests = []
+        for lang_test in load_lang_tests():
             user_settings = dict(
                 MODE='fast', 
                 NBEST_WORDS=False,
                 NBEST=False,
                 FMT='json',
-                CPU_COUNT=1, #we test 1 line at a time, so just load model quickly
+                CPU_COUNT=1, #we test only a few lines, so just load model quickly
                 SYSTEM=None
             )
-            success, mtout, cmd = translation_test(lang_test, user_settings)
+            tests.append((lang_test, user_settings))
+
+        for ((lang_test, _), (success, mtout, cmd)) in zip(tests, translate_batch(tests)):
             results[success].append( (lang_test, mtout, cmd) )
 
-        #print outputs so we can make sure it looks correct
-        for lang_test, mtout, cmd in results[True]:
-            msg = f"SUCCESS: {lang_test.system} "\
-                  f"{lang_test.src_lang}2{lang_test.tgt_lang}: "\
-                  f"{' '.join(cmd)}\n"\
-                  f"SRC:\n{lang_test.src_txt}\n"\
-                  f"REF:\n{lang_test.tgt_txt}\n"\
-                  f"OUT:\n{mtout}\n"
-            logger.info(msg)
-        #print the failures second so they're more salient
-        for lang_test, mtout, cmd in results[False]: 
-            msg = f"***FAIL***: {lang_test.system} "\
-                  f"{lang_test.src_lang}2{lang_test.tgt_lang}: "\
-                  f"{' '.join(cmd)}\n"\
-                  f"SRC:\n{lang_test.src_txt}\n"\
-                  f"REF:\n{lang_test.tgt_txt}\n"\
-                  f"OUT:\n{mtout}\n"
-            logger.info(msg)
-
-        if results[False]:
-            logger.info(f'FAILED test_langs_no_system: {[item[0].system for item in results[False]]}')
+        self.log_results(results, 'test_langs_no_system')
 
         #assert we have no failures 
         self.assertFalse(results[False])
@@ -240,40 +190,23 @@ class TestSystems(unittest.TestCase):
     def test_langs_type_audio(self):
         results = {True: [], False: []}
 
-        for lang_test in lang_tests:
+        tests = []
+        for lang_test in load_lang_tests():
             user_settings = dict(
                 MODE='fast', 
                 NBEST_WORDS=False,
                 NBEST=False,
                 FMT='json',
-                CPU_COUNT=1, #we test 1 line at a time, so just load model quickly
+                CPU_COUNT=1, #we test only a few lines, so just load model quickly
                 SYSTEM=None,
                 TYPE='audio'
             )
-            success, mtout, cmd = translation_test(lang_test, user_settings)
+            tests.append((lang_test, user_settings))
+
+        for ((lang_test, _), (success, mtout, cmd)) in zip(tests, translate_batch(tests)):
             results[success].append( (lang_test, mtout, cmd) )
 
-        #print outputs so we can make sure it looks correct
-        for lang_test, mtout, cmd in results[True]:
-            msg = f"SUCCESS: {lang_test.system} "\
-                  f"{lang_test.src_lang}2{lang_test.tgt_lang}: "\
-                  f"{' '.join(cmd)}\n"\
-                  f"SRC:\n{lang_test.src_txt}\n"\
-                  f"REF:\n{lang_test.tgt_txt}\n"\
-                  f"OUT:\n{mtout}\n"
-            logger.info(msg)
-        #print the failures second so they're more salient
-        for lang_test, mtout, cmd in results[False]: 
-            msg = f"***FAIL***: {lang_test.system} "\
-                  f"{lang_test.src_lang}2{lang_test.tgt_lang}: "\
-                  f"{' '.join(cmd)}\n"\
-                  f"SRC:\n{lang_test.src_txt}\n"\
-                  f"REF:\n{lang_test.tgt_txt}\n"\
-                  f"OUT:\n{mtout}\n"
-            logger.info(msg)
-        
-        if results[False]:
-            logger.info(f'FAILED test_langs_type_audio: {[item[0].system for item in results[False]]}')
+        self.log_results(results, 'test_langs_type_audio')
 
         #assert we have no failures 
         self.assertFalse(results[False])
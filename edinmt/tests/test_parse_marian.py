@@ -2,6 +2,7 @@ import io
 import json
 import logging
 import unittest
+from itertools import product
 
 from edinmt.configs.config import TestConfig
 from edinmt import parse_marian 
@@ -132,6 +133,62 @@ piece1 |||  piece1 -1.73212
 """
 
 
+MARIAN_1BEST = """sent0 top1
+sent1 top1
+"""
+
+MARIAN_2BEST = """0 ||| sent0 top1 ||| F0= -inf ||| -1.69888
+0 ||| sent0 top2 ||| F0= -inf ||| -1.69888
+1 ||| sent1 top1 ||| F0= -inf ||| -1.69888
+1 ||| sent1 top2 ||| F0= -inf ||| -1.69888
+"""
+
+
+class TestParseMarian(unittest.TestCase):
+    def test_parse_marian_1best(self):
+        example = io.StringIO(MARIAN_1BEST)
+        result = parse_marian.parse(example, n_items=None, n_best=1)
+        answer = [
+            ["sent0 top1\n"],
+            ["sent1 top1\n"],
+        ]
+        self.assertEqual([item['translation'] for item in result], answer)
+        self.assertEqual([item['id'] for item in result], [0, 1])
+
+    def test_parse_marian_1best_1items_leaves_rest(self):
+        example = io.BytesIO(MARIAN_1BEST.encode('utf-8'))
+        mtout = io.BytesIO()
+        result = parse_marian.parse(example, n_items=1, n_best=1, mtout=mtout)
+        self.assertEqual([item['translation'] for item in result], [["sent0 top1\n"]])
+        self.assertEqual(mtout.getvalue(), b"sent0 top1\n")
+        self.assertEqual(example.read(), b"sent1 top1\n")
+
+    def test_parse_marian_2best(self):
+        example = io.StringIO(MARIAN_2BEST)
+        result = parse_marian.parse(example, n_items=None, n_best=2)
+        answer = [
+            ["sent0 top1", "sent0 top2"],
+            ["sent1 top1", "sent1 top2"],
+        ]
+        self.assertEqual([item['translation'] for item in result], answer)
+
+    def test_parse_marian_str_same_as_stream(self):
+        for (example, n_best) in ((MARIAN_1BEST, 1), (MARIAN_2BEST, 2)):
+            for n_items in (None, 1):
+                self.assertEqual(
+                    parse_marian.parse(example, n_items=n_items, n_best=n_best),
+                    parse_marian.parse(
+                        io.StringIO(example), n_items=n_items, n_best=n_best),
+                )
+
+    def test_iter_parse_2best_1items_leaves_rest(self):
+        example = io.StringIO(MARIAN_2BEST)
+        result = parse_marian.iter_parse(example, n_items=1, n_best=2)
+        answer = [{'id': 0, 'translation': ["sent0 top1", "sent0 top2"]}]
+        self.assertEqual(list(result), answer)
+        self.assertEqual(example.readline(), "1 ||| sent1 top1 ||| F0= -inf ||| -1.69888\n")
+
+
 class TestParseMarianNbestWords(unittest.TestCase):
     def test_parse_marian_nbestw_1best(self):
         example = io.StringIO(NBEST_WORDS_1BEST)
@@ -251,6 +308,36 @@ class TestParseMarianNbestWords(unittest.TestCase):
         [self.assertTrue('nbest_words' in item) for item in final]
         self.assertEqual(len(final), 1)
 
+    def test_parse_marian_nbestw_str_same_as_stream(self):
+        examples = (
+            (NBEST_WORDS_1BEST, 1), 
+            (NBEST_WORDS_2BEST, 2), 
+            (NBEST_WORDS_1BEST_EMPTY, 1),
+        )
+        for (example, n_best) in examples:
+            for n_items in (None, 1):
+                self.assertEqual(
+                    parse_marian.parse_nbest_words(
+                        example, n_items=n_items, n_best=n_best),
+                    parse_marian.parse_nbest_words(
+                        io.StringIO(example), n_items=n_items, n_best=n_best),
+                )
+
+    def test_iter_unwrap_lines_same_as_unwrap_lines(self):
+        example = NBEST_WORDS_2BEST
+        for (true_ids, batch_size) in product(([0, 0], [0, 1]), (1, 1000)):
+            result = parse_marian.iter_parse_nbest_words(
+                io.StringIO(example), n_items=None, n_best=2)
+            final = parse_marian.iter_unwrap_lines(
+                result, true_ids, n_best=2, batch_size=batch_size)
+            answer = parse_marian.unwrap_lines(
+                parse_marian.parse_nbest_words(
+                    io.StringIO(example), n_items=None, n_best=2),
+                true_ids, 
+                n_best=2
+            )
+            self.assertEqual(list(final), answer)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
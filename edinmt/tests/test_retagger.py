@@ -0,0 +1,66 @@
+import logging
+import unittest
+
+from edinmt.configs.config import TestConfig
+from edinmt import retagger
+
+#be explicit so logging occurs correctly even if this is run as main
+logger = logging.getLogger('edinmt.tests.test_retagger')
+logger.setLevel(TestConfig.LOG_LEVEL)
+
+
+TEXT = "Hello <b>world</b> write to me at john.doe@example.com now @edinmt thanks"
+
+#each kind of tag is numbered separately, in the order they're found
+EXTRACTED = "Hello [TAG0] world [TAG1] write to me at [EML0] now  [HANDLE0]  thanks"
+TAGS = [
+    ['[TAG0]', ' <b>'], 
+    ['[TAG1]', '</b> '], 
+    ['[EML0]', ' john.doe@example.com '], 
+    ['[HANDLE0]', '@edinmt'],
+]
+
+
+def normalize(text):
+    r"""The symbols' surrounding spaces get doubled up, so ignore those."""
+    return ' '.join(text.split())
+
+class TestRetagger(unittest.TestCase):
+    def test_extract_tags(self):
+        text, tags = retagger.extract_tags(TEXT)
+        self.assertEqual(text, EXTRACTED)
+        self.assertEqual(tags, TAGS)
+
+    def test_extract_tags_nothing_to_extract(self):
+        self.assertEqual(retagger.extract_tags("Hello world"), ("Hello world", []))
+
+    def test_reinsert_tags_roundtrip(self):
+        text, tags = retagger.extract_tags(TEXT)
+        result = retagger.reinsert_tags(text, tags)
+        #the symbols are padded with spaces, so the tags end up spaced out
+        answer = "Hello <b> world </b> write to me at john.doe@example.com now @edinmt thanks"
+        self.assertEqual(normalize(result), answer)
+
+    def test_reinsert_tags_translated(self):
+        mt = "Bonjour [TAG0] monde [TAG1] écrivez-moi à [EML0] maintenant [HANDLE0] merci"
+        result = retagger.reinsert_tags(mt, TAGS)
+        answer = "Bonjour <b> monde </b> écrivez-moi à john.doe@example.com maintenant @edinmt merci"
+        self.assertEqual(normalize(result), answer)
+
+    def test_reinsert_tags_dropped_symbol(self):
+        #MT dropped [EML0] and [HANDLE0], so they're appended in order
+        mt = "Bonjour [TAG0] monde [TAG1] merci"
+        result = retagger.reinsert_tags(mt, TAGS)
+        answer = "Bonjour <b> monde </b> merci john.doe@example.com @edinmt"
+        self.assertEqual(normalize(result), answer)
+
+    def test_reinsert_tags_repeated_symbol(self):
+        #only the first occurrence of a symbol gets the tag back
+        mt = "[TAG0] Bonjour [TAG0] [TAG1] [EML0] [HANDLE0]"
+        result = retagger.reinsert_tags(mt, TAGS)
+        answer = "<b> Bonjour [TAG0] </b> john.doe@example.com @edinmt"
+        self.assertEqual(normalize(result), answer)
+
+
+if __name__ == '__main__':
+    unittest.main()
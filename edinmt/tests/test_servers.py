@@ -2,6 +2,7 @@
 #-*- coding: UTF-8 -*-
 import json
 import logging
+import threading
 import unittest
 
 import websocket
@@ -12,6 +13,24 @@ from edinmt.configs.config import TestConfig
 logger = logging.getLogger('edinmt.tests.test_servers')
 logger.setLevel(TestConfig.LOG_LEVEL)
 
+#the requests are the same every time, so serialize them just once
+FA_TEXT = 'ما در "برکلی بایونیکس" به این روبات\u200c\u200cها اگزو اسکلت می\u200cگوئیم.'
+KK_TEXT = 'Ақша-несие саясатының сценарийін қайта жазсақ'
+LONG_TEXT = 'түсіндірме сөздік” → ]]> https://blog.daniyar.info/2019/02/%d0%bd%d2%b1%d1%80%d1%82%d0%b0%d1%81-%d0%be%d2%a3%d0%b4%d0%b0%d1%81%d1%8b%d0%bd%d0%be%d0%b2-%d0%b0%d1%80%d0%b0%d0%b1%d1%88%d0%b0-%d2%9b%d0%b0%d0%b7%d0%b0%d2%9b%d1%88%d0%b0-%d1%82%d2%af%d1%81%d1%96/feed/ 0 3295 Қос тілдік саясатының баяғы жартасы https://blog.daniyar.info/2017/02/%d2%9b%d0%be%d1%81-%d1%82%d1%96%d0%bb%d0%b4%d1%96%d0%ba-%d1%81%d0%b0%d1%8f%d1%81%d0%b0%d1%82%d1%8b%d0%bd%d1%8b%d2%a3-%d0%b1%d0%b0%d1%8f%d2%93%d1%8b-%d0%b6%d0%b0%d1%80%d1%82%d0%b0%d1%81%d1%8b/ https://blog.daniyar.info/2017/02/%d2%9b%d0%be%d1%81-%d1%82%d1%96%d0%bb%d0%b4%d1%96%d0%ba-%d1%81%d0%b0%d1%8f%d1%81%d0%b0%d1%82%d1%8b%d0%bd%d1%8b%d2%a3-%d0%b1%d0%b0%d1%8f%d2%93%d1%8b-%d0%b6%d0%b0%d1%80%d1%82%d0%b0%d1%81%d1%8b/#respond Wed, 22 Feb 2017 20:31:43 +0000 https://blog.daniyar.info/?p=2456 Continue reading Қос тілдік саясатының баяғы жартасы → ]]> https://blog.daniyar.info/2017/02/%d2%9b%d0%be%d1%81-%d1%82%d1%96%d0%bb%d0%b4%d1%96%d0%ba-%d1%81%d0%b0%d1%8f%d1%81%d0%b0%d1%82%d1%8b%d0%bd%d1%8b%d2%a3-%d0%b1%d0%b0%d1%8f%d2%93%d1%8b-%d0%b6%d0%b0%d1%80%d1%82%d0%b0%d1%81%d1%8b/feed/ 0 2456 Өліспей беріспейтін орысшыл аудармашылар https://blog.daniyar.info/2012/04/%d3%a9%d0%bb%d1%96%d1%81%d0%bf%d0%b5%d0%b9-%d0%b1%d0%b5%d1%80%d1%96%d1%81%d0%bf%d0%b5%d0%b9%d1%82%d1%96%d0%bd-%d0%be%d1%80%d1%8b%d1%81%d1%88%d1%8b%d0%bb-%d0%b0%d1%83%d0%b4%d0%b0%d1%80%d0%bc%d0%b0/ https://blog.daniyar.info/2012/04/%d3%a9%d0%bb%d1%96%d1%81%d0%bf%d0%b5%d0%b9-%d0%b1%d0%b5%d1%80%d1%96%d1%81%d0%bf%d0%b5%d0%b9%d1%82%d1%96%d0%bd-%d0%be%d1%80%d1%8b%d1%81%d1%88%d1%8b%d0%bb-%d0%b0%d1%83%d0%b4%d0%b0%d1%80%d0%bc%d0%b0/#respond Sun, 22 Apr 2012 16:51:35 +0000 https://blog.daniyar.info/2012/04/%d3%a9%d0%bb%d1%96%d1%81%d0%bf%d0%b5%d0%b9-%d0%b1%d0%b5%d1%80%d1%96%d1%81%d0%bf%d0%b5%d0%b9%d1%82%d1%96%d0%bd-%d0%be%d1%80%d1%8b%d1%81%d1%88%d1%8b%d0%bb-%d0%b0%d1%83%d0%b4%d0%b0%d1%80%d0%bc%d0%b0/'
+
+def _request(**data):
+    return json.dumps(data, ensure_ascii=False)
+
+FA_REQUEST = _request(src_lang='fa', tgt_lang='en', text=FA_TEXT)
+KK_REQUEST = _request(src_lang='kk', tgt_lang='en', text=KK_TEXT)
+KK_QUERY_REQUEST = _request(src_lang='kk', tgt_lang='en', query='query', text=KK_TEXT)
+MULTILINE_REQUEST = _request(src_lang='fa', tgt_lang='en', text=FA_TEXT + '\n' + FA_TEXT)
+LONG_LINE_REQUEST = _request(src_lang='kk', tgt_lang='en', text=LONG_TEXT)
+LONG_LINE_QUERY_REQUEST = _request(src_lang='kk', tgt_lang='en', query='dictionary', text=LONG_TEXT)
+TWO_SENTS_REQUEST = _request(src_lang='kk', tgt_lang='en', text=KK_TEXT + '\n' + KK_TEXT)
+TWO_SENTS_QUERY_REQUEST = _request(src_lang='kk', tgt_lang='en', query='query\nquery', text=KK_TEXT + '\n' + KK_TEXT)
+TWO_SENTS_QUERY_MALFORMED_REQUEST = _request(src_lang='kk', tgt_lang='en', query='query', text=KK_TEXT + '\n' + KK_TEXT)
+
 class TestRunningTranslateServer(unittest.TestCase):
     r"""
     This is more like an integration test. The Docker environment sets
@@ -24,12 +43,20 @@ class TestRunningTranslateServer(unittest.TestCase):
     2) python3.7 edinmt/launch/launch_marian_server.py
     3) python3.7 edinmt/launch/launch_pipeline_server.py
     """
+    url = "ws://%s:%s/" %('localhost', 8081)
+
+    @classmethod
+    def setUpClass(cls):
+        #probe the servers once, instead of failing to connect in every test
+        try:
+            websocket.create_connection(cls.url, timeout=1).close()
+        except:
+            raise unittest.SkipTest("Skipping due to unavailable websocket marian and pipeline servers.")
+
     def setUp(self):
-        host = 'localhost'
-        port = 8081
-        ws = None
+        self.ws = None
         try:
-            self.ws = websocket.create_connection("ws://%s:%s/" %(host, port))
+            self.ws = websocket.create_connection(self.url)
         except:
             raise unittest.SkipTest("Skipping due to unavailable websocket marian and pipeline servers.")
 
@@ -38,8 +65,7 @@ class TestRunningTranslateServer(unittest.TestCase):
             self.ws.close()
 
     def test_fa(self):
-        all_input = {'src_lang': 'fa', 'tgt_lang': 'en', 'text': 'ما در "برکلی بایونیکس" به این روبات‌‌ها اگزو اسکلت می‌گوئیم.'}
-        all_input = json.dumps(all_input, ensure_ascii=False)
+        all_input = FA_REQUEST
         logger.info(f'REQUEST: {all_input}')
         self.ws.send(all_input)
         result = self.ws.recv()
@@ -47,8 +73,7 @@ class TestRunningTranslateServer(unittest.TestCase):
         self.assertTrue(result)
 
     def test_kk(self):
-        all_input = {'src_lang': 'kk', 'tgt_lang': 'en', 'text': 'Ақша-несие саясатының сценарийін қайта жазсақ'}
-        all_input = json.dumps(all_input, ensure_ascii=False)
+        all_input = KK_REQUEST
         logger.info(f'REQUEST: {all_input}')
         self.ws.send(all_input)
         result = self.ws.recv()
@@ -56,8 +81,7 @@ class TestRunningTranslateServer(unittest.TestCase):
         self.assertTrue(result)
 
     def test_kk_query(self):
-        all_input = {'src_lang': 'kk', 'tgt_lang': 'en', 'query': 'query', 'text': 'Ақша-несие саясатының сценарийін қайта жазсақ'}
-        all_input = json.dumps(all_input, ensure_ascii=False)
+        all_input = KK_QUERY_REQUEST
         logger.info(f'REQUEST: {all_input}')
         self.ws.send(all_input)
         result = self.ws.recv()
@@ -65,12 +89,7 @@ class TestRunningTranslateServer(unittest.TestCase):
         self.assertTrue(result)
 
     def test_multiline(self):
-        all_input = {
-            'src_lang': 'fa', 
-            'tgt_lang': 'en', 
-            'text': 'ما در "برکلی بایونیکس" به این روبات‌‌ها اگزو اسکلت می‌گوئیم.\nما در "برکلی بایونیکس" به این روبات‌‌ها اگزو اسکلت می‌گوئیم.'
-        }
-        all_input = json.dumps(all_input, ensure_ascii=False)
+        all_input = MULTILINE_REQUEST
         logger.info(f'REQUEST: {all_input}')
         self.ws.send(all_input)
         result = self.ws.recv()
@@ -78,10 +97,7 @@ class TestRunningTranslateServer(unittest.TestCase):
         self.assertTrue(result)
 
     def test_long_line(self):
-        all_input = {
-            'src_lang': 'kk', 'tgt_lang': 'en', 'text': "түсіндірме сөздік” → ]]> https://blog.daniyar.info/2019/02/%d0%bd%d2%b1%d1%80%d1%82%d0%b0%d1%81-%d0%be%d2%a3%d0%b4%d0%b0%d1%81%d1%8b%d0%bd%d0%be%d0%b2-%d0%b0%d1%80%d0%b0%d0%b1%d1%88%d0%b0-%d2%9b%d0%b0%d0%b7%d0%b0%d2%9b%d1%88%d0%b0-%d1%82%d2%af%d1%81%d1%96/feed/ 0 3295 Қос тілдік саясатының баяғы жартасы https://blog.daniyar.info/2017/02/%d2%9b%d0%be%d1%81-%d1%82%d1%96%d0%bb%d0%b4%d1%96%d0%ba-%d1%81%d0%b0%d1%8f%d1%81%d0%b0%d1%82%d1%8b%d0%bd%d1%8b%d2%a3-%d0%b1%d0%b0%d1%8f%d2%93%d1%8b-%d0%b6%d0%b0%d1%80%d1%82%d0%b0%d1%81%d1%8b/ https://blog.daniyar.info/2017/02/%d2%9b%d0%be%d1%81-%d1%82%d1%96%d0%bb%d0%b4%d1%96%d0%ba-%d1%81%d0%b0%d1%8f%d1%81%d0%b0%d1%82%d1%8b%d0%bd%d1%8b%d2%a3-%d0%b1%d0%b0%d1%8f%d2%93%d1%8b-%d0%b6%d0%b0%d1%80%d1%82%d0%b0%d1%81%d1%8b/#respond Wed, 22 Feb 2017 20:31:43 +0000 https://blog.daniyar.info/?p=2456 Continue reading Қос тілдік саясатының баяғы жартасы → ]]> https://blog.daniyar.info/2017/02/%d2%9b%d0%be%d1%81-%d1%82%d1%96%d0%bb%d0%b4%d1%96%d0%ba-%d1%81%d0%b0%d1%8f%d1%81%d0%b0%d1%82%d1%8b%d0%bd%d1%8b%d2%a3-%d0%b1%d0%b0%d1%8f%d2%93%d1%8b-%d0%b6%d0%b0%d1%80%d1%82%d0%b0%d1%81%d1%8b/feed/ 0 2456 Өліспей беріспейтін орысшыл аудармашылар https://blog.daniyar.info/2012/04/%d3%a9%d0%bb%d1%96%d1%81%d0%bf%d0%b5%d0%b9-%d0%b1%d0%b5%d1%80%d1%96%d1%81%d0%bf%d0%b5%d0%b9%d1%82%d1%96%d0%bd-%d0%be%d1%80%d1%8b%d1%81%d1%88%d1%8b%d0%bb-%d0%b0%d1%83%d0%b4%d0%b0%d1%80%d0%bc%d0%b0/ https://blog.daniyar.info/2012/04/%d3%a9%d0%bb%d1%96%d1%81%d0%bf%d0%b5%d0%b9-%d0%b1%d0%b5%d1%80%d1%96%d1%81%d0%bf%d0%b5%d0%b9%d1%82%d1%96%d0%bd-%d0%be%d1%80%d1%8b%d1%81%d1%88%d1%8b%d0%bb-%d0%b0%d1%83%d0%b4%d0%b0%d1%80%d0%bc%d0%b0/#respond Sun, 22 Apr 2012 16:51:35 +0000 https://blog.daniyar.info/2012/04/%d3%a9%d0%bb%d1%96%d1%81%d0%bf%d0%b5%d0%b9-%d0%b1%d0%b5%d1%80%d1%96%d1%81%d0%bf%d0%b5%d0%b9%d1%82%d1%96%d0%bd-%d0%be%d1%80%d1%8b%d1%81%d1%88%d1%8b%d0%bb-%d0%b0%d1%83%d0%b4%d0%b0%d1%80%d0%bc%d0%b0/"
-        }
-        all_input = json.dumps(all_input, ensure_ascii=False)
+        all_input = LONG_LINE_REQUEST
         logger.info(f'REQUEST: {all_input}')
         self.ws.send(all_input)
         result = self.ws.recv()
@@ -89,10 +105,7 @@ class TestRunningTranslateServer(unittest.TestCase):
         self.assertTrue(result)
 
     def test_long_line_query(self):
-        all_input = {
-            'src_lang': 'kk', 'tgt_lang': 'en', 'query': 'dictionary', 'text': "түсіндірме сөздік” → ]]> https://blog.daniyar.info/2019/02/%d0%bd%d2%b1%d1%80%d1%82%d0%b0%d1%81-%d0%be%d2%a3%d0%b4%d0%b0%d1%81%d1%8b%d0%bd%d0%be%d0%b2-%d0%b0%d1%80%d0%b0%d0%b1%d1%88%d0%b0-%d2%9b%d0%b0%d0%b7%d0%b0%d2%9b%d1%88%d0%b0-%d1%82%d2%af%d1%81%d1%96/feed/ 0 3295 Қос тілдік саясатының баяғы жартасы https://blog.daniyar.info/2017/02/%d2%9b%d0%be%d1%81-%d1%82%d1%96%d0%bb%d0%b4%d1%96%d0%ba-%d1%81%d0%b0%d1%8f%d1%81%d0%b0%d1%82%d1%8b%d0%bd%d1%8b%d2%a3-%d0%b1%d0%b0%d1%8f%d2%93%d1%8b-%d0%b6%d0%b0%d1%80%d1%82%d0%b0%d1%81%d1%8b/ https://blog.daniyar.info/2017/02/%d2%9b%d0%be%d1%81-%d1%82%d1%96%d0%bb%d0%b4%d1%96%d0%ba-%d1%81%d0%b0%d1%8f%d1%81%d0%b0%d1%82%d1%8b%d0%bd%d1%8b%d2%a3-%d0%b1%d0%b0%d1%8f%d2%93%d1%8b-%d0%b6%d0%b0%d1%80%d1%82%d0%b0%d1%81%d1%8b/#respond Wed, 22 Feb 2017 20:31:43 +0000 https://blog.daniyar.info/?p=2456 Continue reading Қос тілдік саясатының баяғы жартасы → ]]> https://blog.daniyar.info/2017/02/%d2%9b%d0%be%d1%81-%d1%82%d1%96%d0%bb%d0%b4%d1%96%d0%ba-%d1%81%d0%b0%d1%8f%d1%81%d0%b0%d1%82%d1%8b%d0%bd%d1%8b%d2%a3-%d0%b1%d0%b0%d1%8f%d2%93%d1%8b-%d0%b6%d0%b0%d1%80%d1%82%d0%b0%d1%81%d1%8b/feed/ 0 2456 Өліспей беріспейтін орысшыл аудармашылар https://blog.daniyar.info/2012/04/%d3%a9%d0%bb%d1%96%d1%81%d0%bf%d0%b5%d0%b9-%d0%b1%d0%b5%d1%80%d1%96%d1%81%d0%bf%d0%b5%d0%b9%d1%82%d1%96%d0%bd-%d0%be%d1%80%d1%8b%d1%81%d1%88%d1%8b%d0%bb-%d0%b0%d1%83%d0%b4%d0%b0%d1%80%d0%bc%d0%b0/ https://blog.daniyar.info/2012/04/%d3%a9%d0%bb%d1%96%d1%81%d0%bf%d0%b5%d0%b9-%d0%b1%d0%b5%d1%80%d1%96%d1%81%d0%bf%d0%b5%d0%b9%d1%82%d1%96%d0%bd-%d0%be%d1%80%d1%8b%d1%81%d1%88%d1%8b%d0%bb-%d0%b0%d1%83%d0%b4%d0%b0%d1%80%d0%bc%d0%b0/#respond Sun, 22 Apr 2012 16:51:35 +0000 https://blog.daniyar.info/2012/04/%d3%a9%d0%bb%d1%96%d1%81%d0%bf%d0%b5%d0%b9-%d0%b1%d0%b5%d1%80%d1%96%d1%81%d0%bf%d0%b5%d0%b9%d1%82%d1%96%d0%bd-%d0%be%d1%80%d1%8b%d1%81%d1%88%d1%8b%d0%bb-%d0%b0%d1%83%d0%b4%d0%b0%d1%80%d0%bc%d0%b0/"
-        }
-        all_input = json.dumps(all_input, ensure_ascii=False)
+        all_input = LONG_LINE_QUERY_REQUEST
         logger.info(f'REQUEST: {all_input}')
         self.ws.send(all_input)
         result = self.ws.recv()
@@ -100,8 +113,7 @@ class TestRunningTranslateServer(unittest.TestCase):
         self.assertTrue(result)
 
     def test_two_sents(self):
-        all_input = {'src_lang': 'kk', 'tgt_lang': 'en', 'text': 'Ақша-несие саясатының сценарийін қайта жазсақ\nАқша-несие саясатының сценарийін қайта жазсақ'}
-        all_input = json.dumps(all_input, ensure_ascii=False)
+        all_input = TWO_SENTS_REQUEST
         logger.info(f'REQUEST: {all_input}')
         self.ws.send(all_input)
         result = self.ws.recv()
@@ -109,8 +121,7 @@ class TestRunningTranslateServer(unittest.TestCase):
         self.assertTrue(result)
 
     def test_two_sents_query(self):
-        all_input = {'src_lang': 'kk', 'tgt_lang': 'en', 'query': 'query\nquery', 'text': 'Ақша-несие саясатының сценарийін қайта жазсақ\nАқша-несие саясатының сценарийін қайта жазсақ'}
-        all_input = json.dumps(all_input, ensure_ascii=False)
+        all_input = TWO_SENTS_QUERY_REQUEST
         logger.info(f'REQUEST: {all_input}')
         self.ws.send(all_input)
         result = self.ws.recv()
@@ -118,8 +129,7 @@ class TestRunningTranslateServer(unittest.TestCase):
         self.assertTrue(result)
 
     def test_two_sents_query_malformed(self):
-        all_input = {'src_lang': 'kk', 'tgt_lang': 'en', 'query': 'query', 'text': 'Ақша-несие саясатының сценарийін қайта жазсақ\nАқша-несие саясатының сценарийін қайта жазсақ'}
-        all_input = json.dumps(all_input, ensure_ascii=False)
+        all_input = TWO_SENTS_QUERY_MALFORMED_REQUEST
         logger.info(f'REQUEST: {all_input}')
         self.ws.send(all_input)
         result = self.ws.recv()
@@ -128,16 +138,23 @@ class TestRunningTranslateServer(unittest.TestCase):
         self.assertTrue('error' in result)
 
     def test_many_requests(self):
-        all_input = {'src_lang': 'kk', 'tgt_lang': 'en', 'text': 'Ақша-несие саясатының сценарийін қайта жазсақ'}
-        all_input = json.dumps(all_input, ensure_ascii=False)
+        all_input = KK_REQUEST
         results = []
         logger.info(f'REQUEST x500: {all_input}')
+        #websockets are full duplex, so keep sending while we receive instead 
+        #of waiting a whole round trip (and translation) for every request
+        def send_all():
+            for i in range(500):
+                self.ws.send(all_input)
+        sender = threading.Thread(target=send_all)
+        sender.start()
         for i in range(500):
-            self.ws.send(all_input)
             result = self.ws.recv()
             results.append(result)
+        sender.join()
         logger.info(f"RESPONSE x{len(results)}")
         self.assertEqual(len(results), 500)
+        self.assertTrue(all(results))
 
 
 
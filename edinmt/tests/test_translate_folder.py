@@ -8,7 +8,9 @@ from unittest import mock
 
 from edinmt import translate_folder
 from edinmt.configs.config import TestConfig
+from edinmt.tests import link_or_copy, walk_files
 from edinmt.get_settings import get_decoder_settings 
+from edinmt.parse_marian import json_loads
 
 #be explicit so logging occurs correctly even if this is run as main
 logger = logging.getLogger('edinmt.tests.test_translate')
@@ -17,38 +19,52 @@ logger.setLevel(TestConfig.LOG_LEVEL)
 #this file is 13176 bytes long, 100 lines long
 TEST_FILE = os.path.join(TestConfig.ROOT_DIR, "edinmt", "tests", "data", "original", "chunk.fa")
 PLAYGROUND_DIR = os.path.join(TestConfig.ROOT_DIR, "edinmt", "tests", "data", "playground")
+#the files that translating the translate_me dir should produce
+OUTPUT_NAMES = ['txt.0', 'txt.1', 'txt.2', os.path.join('subfolder', 'txt.3')]
+
+def make_translate_me_dir(playground_dir):
+    r"""
+    Make the input dir shared by a test class: TEST_FILE linked 4 times, one
+    of them in a subfolder. Returns the path of the input dir.
+    """
+    translate_me_dir = os.path.join(playground_dir, 'translate_me')
+    os.makedirs(os.path.join(translate_me_dir, 'subfolder'), exist_ok=True)
+    for i in range(3):
+        link_or_copy(TEST_FILE, os.path.join(translate_me_dir, f'txt.{i}'))
+    link_or_copy(TEST_FILE, os.path.join(translate_me_dir, 'subfolder', 'txt.3'))
+    return translate_me_dir
 
 @unittest.skip('for now')
 class TestTranslateFolder(unittest.TestCase):
     maxDiff = None
 
-    def setUp(self):
+    @classmethod
+    def setUpClass(cls):
         r"""
         Make a fake directory structure for testing purposes, which will be
-        deleted at the end of the test.
+        deleted at the end of the tests; the tests only read the input dir,
+        so they all share it, and each test gets its own output dir.
         """
-        self.name = self.id().split('.')[-1]
-        self.translate_me_dir = os.path.join(PLAYGROUND_DIR, self.name, 'translate_me')
-        self.mtout_dir = os.path.join(PLAYGROUND_DIR, self.name, 'mtout')
-        os.makedirs(self.translate_me_dir, exist_ok=True)
-        os.makedirs(os.path.join(self.translate_me_dir, 'subfolder'), exist_ok=True)
-        for i in range(3):
-            shutil.copy(TEST_FILE, os.path.join(self.translate_me_dir, f'txt.{i}'))
-        shutil.copy(TEST_FILE, os.path.join(self.translate_me_dir, os.path.join('subfolder', f'txt.3')))
-        self.user_settings = dict(
+        cls.playground_dir = os.path.join(PLAYGROUND_DIR, cls.__name__)
+        cls.translate_me_dir = make_translate_me_dir(cls.playground_dir)
+        cls.user_settings = dict(
             MODE='fast', 
             NBEST_WORDS=False,
             SYSTEM='faen'
         )
 
-    def tearDown(self):
+    @classmethod
+    def tearDownClass(cls):
         r"""
         Completely delete the entire contents of the testing directory 
-        that we created in setUp.
+        that we created in setUpClass.
         """
         if TestConfig.PURGE:
-            shutil.rmtree(self.translate_me_dir)
-            shutil.rmtree(self.mtout_dir)
+            shutil.rmtree(cls.playground_dir)
+
+    def setUp(self):
+        self.name = self.id().split('.')[-1]
+        self.mtout_dir = os.path.join(self.playground_dir, 'mtout', self.name)
 
     def test_translate_folder_1best_fmt_json(self):
         user_settings = self.user_settings.copy()
@@ -70,24 +86,18 @@ class TestTranslateFolder(unittest.TestCase):
             fmt=decoder_settings.fmt
         )
 
-        result = set([os.path.join(r, f) 
-                        for r, d, fs in os.walk(self.mtout_dir) 
-                            for f in fs 
-                                if 'tmp' not in r])
-        answer = set([
-            f'{self.mtout_dir}/txt.0', 
-            f'{self.mtout_dir}/txt.1', 
-            f'{self.mtout_dir}/txt.2', 
-            f'{self.mtout_dir}/subfolder/txt.3', 
-        ])
-
-        for name in ['txt.0', 'txt.1', 'txt.2', os.path.join('subfolder', 'txt.3')]:
+        result = set(walk_files(self.mtout_dir, exclude={'tmp'}))
+        answer = set(os.path.join(self.mtout_dir, name) for name in OUTPUT_NAMES)
+
+        for name in OUTPUT_NAMES:
             with open(os.path.join(self.mtout_dir, name), 'r', encoding='utf-8') as fh:
                 data = fh.readlines()
                 self.assertEqual(len(data), 100)
-                self.assertTrue(json.loads(data[0]))
-                self.assertEqual(json.loads(data[0])['id'], 0)
-                self.assertEqual(json.loads(data[99])['id'], 99)
+                first = json_loads(data[0])
+                last = json_loads(data[99])
+                self.assertTrue(first)
+                self.assertEqual(first['id'], 0)
+                self.assertEqual(last['id'], 99)
                 self.assertTrue('|||' not in data[0])
 
         self.assertEqual(answer, result)
@@ -112,25 +122,19 @@ class TestTranslateFolder(unittest.TestCase):
             fmt=decoder_settings.fmt
         )
 
-        result = set([os.path.join(r, f) 
-                        for r, d, fs in os.walk(self.mtout_dir) 
-                            for f in fs 
-                                if r != 'tmp'])
-        answer = set([
-            f'{self.mtout_dir}/txt.0',
-            f'{self.mtout_dir}/txt.1', 
-            f'{self.mtout_dir}/txt.2', 
-            f'{self.mtout_dir}/subfolder/txt.3', 
-        ])
+        result = set(walk_files(self.mtout_dir))
+        answer = set(os.path.join(self.mtout_dir, name) for name in OUTPUT_NAMES)
 
         total = decoder_settings.n_best*100
 
-        for name in ['txt.0', 'txt.1', 'txt.2', os.path.join('subfolder', 'txt.3')]:
+        for name in OUTPUT_NAMES:
             with open(os.path.join(self.mtout_dir, name), 'r', encoding='utf-8') as fh:
                 data = fh.readlines()
                 self.assertEqual(len(data), total)
-                self.assertEqual(json.loads(data[0])['id'], 0)
-                self.assertEqual(json.loads(data[total-1])['id'], 99)
+                first = json_loads(data[0])
+                last = json_loads(data[total-1])
+                self.assertEqual(first['id'], 0)
+                self.assertEqual(last['id'], 99)
                 self.assertTrue('|||' not in data[0])
 
         self.assertEqual(answer, result)
@@ -155,22 +159,14 @@ class TestTranslateFolder(unittest.TestCase):
             fmt=decoder_settings.fmt
         )
 
-        result = set([os.path.join(r, f) 
-                        for r, d, fs in os.walk(self.mtout_dir) 
-                            for f in fs 
-                                if 'tmp' not in r])
-        answer = set([
-            f'{self.mtout_dir}/txt.0', 
-            f'{self.mtout_dir}/txt.1', 
-            f'{self.mtout_dir}/txt.2', 
-            f'{self.mtout_dir}/subfolder/txt.3', 
-        ])
-
-        for name in ['txt.0', 'txt.1', 'txt.2', os.path.join('subfolder', 'txt.3')]:
+        result = set(walk_files(self.mtout_dir, exclude={'tmp'}))
+        answer = set(os.path.join(self.mtout_dir, name) for name in OUTPUT_NAMES)
+
+        for name in OUTPUT_NAMES:
             with open(os.path.join(self.mtout_dir, name), 'r', encoding='utf-8') as fh:
                 data = fh.readlines()
                 self.assertEqual(len(data), 100)
-                self.assertRaises(json.JSONDecodeError, json.loads, s=data[0])
+                self.assertRaises(json.JSONDecodeError, json_loads, data[0])
                 self.assertEqual(data[0].split(' ||| ')[0], '0')
                 self.assertEqual(data[99].split(' ||| ')[0], '99')
 
@@ -196,22 +192,14 @@ class TestTranslateFolder(unittest.TestCase):
             fmt=decoder_settings.fmt
         )
 
-        result = set([os.path.join(r, f) 
-                        for r, d, fs in os.walk(self.mtout_dir) 
-                            for f in fs 
-                                if 'tmp' not in r])
-        answer = set([
-            f'{self.mtout_dir}/txt.0', 
-            f'{self.mtout_dir}/txt.1', 
-            f'{self.mtout_dir}/txt.2', 
-            f'{self.mtout_dir}/subfolder/txt.3', 
-        ])
-
-        for name in ['txt.0', 'txt.1', 'txt.2', os.path.join('subfolder', 'txt.3')]:
+        result = set(walk_files(self.mtout_dir, exclude={'tmp'}))
+        answer = set(os.path.join(self.mtout_dir, name) for name in OUTPUT_NAMES)
+
+        for name in OUTPUT_NAMES:
             with open(os.path.join(self.mtout_dir, name), 'r', encoding='utf-8') as fh:
                 data = fh.readlines()
                 self.assertEqual(len(data), 100)
-                self.assertRaises(json.JSONDecodeError, json.loads, s=data[0])
+                self.assertRaises(json.JSONDecodeError, json_loads, data[0])
                 self.assertTrue('|||' not in data[0])
 
         self.assertEqual(answer, result)
@@ -220,33 +208,33 @@ class TestTranslateFolder(unittest.TestCase):
 class TestTranslateFolderNbestWords(unittest.TestCase):
     maxDiff = None
 
-    def setUp(self):
+    @classmethod
+    def setUpClass(cls):
         r"""
         Make a fake directory structure for testing purposes, which will be
-        deleted at the end of the test.
+        deleted at the end of the tests; the tests only read the input dir,
+        so they all share it, and each test gets its own output dir.
         """
-        self.name = self.id().split('.')[-1]
-        self.translate_me_dir = os.path.join(PLAYGROUND_DIR, self.name, 'translate_me')
-        self.mtout_dir = os.path.join(PLAYGROUND_DIR, self.name, 'mtout')
-        os.makedirs(self.translate_me_dir, exist_ok=True)
-        os.makedirs(os.path.join(self.translate_me_dir, 'subfolder'), exist_ok=True)
-        for i in range(3):
-            shutil.copy(TEST_FILE, os.path.join(self.translate_me_dir, f'txt.{i}'))
-        shutil.copy(TEST_FILE, os.path.join(self.translate_me_dir, os.path.join('subfolder', f'txt.3')))
-        self.user_settings = dict(
+        cls.playground_dir = os.path.join(PLAYGROUND_DIR, cls.__name__)
+        cls.translate_me_dir = make_translate_me_dir(cls.playground_dir)
+        cls.user_settings = dict(
             MODE='fast', 
             NBEST_WORDS=True,
             SYSTEM='faen'
         )
 
-    def tearDown(self):
+    @classmethod
+    def tearDownClass(cls):
         r"""
         Completely delete the entire contents of the testing directory 
-        that we created in setUp.
+        that we created in setUpClass.
         """
         if TestConfig.PURGE:
-            shutil.rmtree(self.translate_me_dir)
-            shutil.rmtree(self.mtout_dir)
+            shutil.rmtree(cls.playground_dir)
+
+    def setUp(self):
+        self.name = self.id().split('.')[-1]
+        self.mtout_dir = os.path.join(self.playground_dir, 'mtout', self.name)
 
     def test_translate_folder_1best_json_nbest_words(self):
         user_settings = self.user_settings.copy()
@@ -269,24 +257,18 @@ class TestTranslateFolderNbestWords(unittest.TestCase):
             purge=TestConfig.PURGE,
         )
 
-        result = set([os.path.join(r, f) 
-                        for r, d, fs in os.walk(self.mtout_dir) 
-                            for f in fs 
-                                if 'tmp' not in r])
-        answer = set([
-            f'{self.mtout_dir}/txt.0', 
-            f'{self.mtout_dir}/txt.1', 
-            f'{self.mtout_dir}/txt.2', 
-            f'{self.mtout_dir}/subfolder/txt.3', 
-        ])
-
-        for name in ['txt.0', 'txt.1', 'txt.2', os.path.join('subfolder', 'txt.3')]:
+        result = set(walk_files(self.mtout_dir, exclude={'tmp'}))
+        answer = set(os.path.join(self.mtout_dir, name) for name in OUTPUT_NAMES)
+
+        for name in OUTPUT_NAMES:
             with open(os.path.join(self.mtout_dir, name), 'r', encoding='utf-8') as fh:
                 data = fh.readlines()
                 self.assertEqual(len(data), 100)
-                self.assertEqual(json.loads(data[0])['id'], 0)
-                self.assertEqual(json.loads(data[99])['id'], 99)
-                self.assertTrue(json.loads(data[0])['nbest_words'])
+                first = json_loads(data[0])
+                last = json_loads(data[99])
+                self.assertEqual(first['id'], 0)
+                self.assertEqual(last['id'], 99)
+                self.assertTrue(first['nbest_words'])
                 self.assertTrue('|||' not in data[0])
 
         self.assertEqual(answer, result)
@@ -312,26 +294,20 @@ class TestTranslateFolderNbestWords(unittest.TestCase):
             purge=TestConfig.PURGE,
         )
 
-        result = set([os.path.join(r, f) 
-                        for r, d, fs in os.walk(self.mtout_dir) 
-                            for f in fs 
-                                if 'tmp' not in r])
-        answer = set([
-            f'{self.mtout_dir}/txt.0', 
-            f'{self.mtout_dir}/txt.1', 
-            f'{self.mtout_dir}/txt.2', 
-            f'{self.mtout_dir}/subfolder/txt.3', 
-        ])
+        result = set(walk_files(self.mtout_dir, exclude={'tmp'}))
+        answer = set(os.path.join(self.mtout_dir, name) for name in OUTPUT_NAMES)
 
         total = decoder_settings.n_best*100
         
-        for name in ['txt.0', 'txt.1', 'txt.2', os.path.join('subfolder', 'txt.3')]:
+        for name in OUTPUT_NAMES:
             with open(os.path.join(self.mtout_dir, name), 'r', encoding='utf-8') as fh:
                 data = fh.readlines()
                 self.assertEqual(len(data), total)
-                self.assertEqual(json.loads(data[0])['id'], 0)
-                self.assertEqual(json.loads(data[total-1])['id'], 99)
-                self.assertTrue(json.loads(data[0])['nbest_words'])
+                first = json_loads(data[0])
+                last = json_loads(data[total-1])
+                self.assertEqual(first['id'], 0)
+                self.assertEqual(last['id'], 99)
+                self.assertTrue(first['nbest_words'])
                 self.assertTrue('|||' not in data[0])
 
         self.assertEqual(answer, result)
@@ -1,4 +1,3 @@
-import json
 import logging
 import os
 import pathlib
@@ -9,6 +8,7 @@ from unittest import mock
 from edinmt.configs.config import TestConfig
 from edinmt import translate_input 
 from edinmt.get_settings import get_decoder_settings 
+from edinmt.parse_marian import json_loads
 
 #be explicit so logging occurs correctly even if this is run as main
 logger = logging.getLogger('edinmt.tests.test_translate')
@@ -76,8 +76,10 @@ class TestTranslateInput(unittest.TestCase):
         
         self.assertEqual(returncode, 0)
         self.assertEqual(len(data), total)
-        self.assertEqual(json.loads(data[0])['id'], 0)
-        self.assertEqual(json.loads(data[total-1])['id'], 99)
+        first = json_loads(data[0])
+        last = json_loads(data[total-1])
+        self.assertEqual(first['id'], 0)
+        self.assertEqual(last['id'], 99)
         self.assertTrue('|||' not in data[0])
 
     def test_translate_input_nbest_fmt_marian(self):
@@ -144,8 +146,10 @@ class TestTranslateInput(unittest.TestCase):
         
         self.assertEqual(returncode, 0)
         self.assertEqual(len(data), 100)
-        self.assertEqual(json.loads(data[0])['id'], 0)
-        self.assertEqual(json.loads(data[99])['id'], 99)
+        first = json_loads(data[0])
+        last = json_loads(data[99])
+        self.assertEqual(first['id'], 0)
+        self.assertEqual(last['id'], 99)
         self.assertTrue('|||' not in data[0])
 
     def test_translate_input_1best_fmt_marian(self):
@@ -237,9 +241,11 @@ class TestTranslateInputNbestWords(unittest.TestCase):
         
         self.assertEqual(returncode, 0)
         self.assertEqual(len(data), 100)
-        self.assertEqual(json.loads(data[0])['id'], 0)
-        self.assertEqual(json.loads(data[99])['id'], 99)
-        self.assertTrue(json.loads(data[0])['nbest_words'])
+        first = json_loads(data[0])
+        last = json_loads(data[99])
+        self.assertEqual(first['id'], 0)
+        self.assertEqual(last['id'], 99)
+        self.assertTrue(first['nbest_words'])
         self.assertTrue('|||' not in data[0])
 
 
@@ -0,0 +1,79 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from edinmt.configs.config import TestConfig
+from edinmt.utils import fix_and_count, get_file_length
+
+#be explicit so logging occurs correctly even if this is run as main
+logger = logging.getLogger('edinmt.tests.test_utils')
+logger.setLevel(TestConfig.LOG_LEVEL)
+
+
+class TestFileLength(unittest.TestCase):
+    r"""
+    fix_and_count and get_file_length count records like awk does (a last 
+    line without a trailing newline still counts), reading in chunks, so we
+    also try tiny chunk sizes to hit the chunk boundaries.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, text):
+        fp = os.path.join(self.tmpdir, name)
+        with open(fp, 'w', encoding='utf-8', newline='') as outfile:
+            outfile.write(text)
+        return fp
+
+    def fix(self, text, chunk_size):
+        fp = self.write('in.txt', text)
+        outfp = os.path.join(self.tmpdir, 'out.txt')
+        length = fix_and_count(fp, outfp, chunk_size=chunk_size)
+        with open(outfp, 'r', encoding='utf-8', newline='') as infile:
+            return infile.read(), length
+
+    def test_fix_and_count_trailing_newline(self):
+        for chunk_size in [1, 2, 3, 1 << 20]:
+            self.assertEqual(self.fix('a\nb\n', chunk_size), ('a\nb\n', 2))
+
+    def test_fix_and_count_no_trailing_newline(self):
+        for chunk_size in [1, 2, 3, 1 << 20]:
+            self.assertEqual(self.fix('a\nbé', chunk_size), ('a\nbé', 2))
+
+    def test_fix_and_count_carriage_return_only_chunks(self):
+        #with chunk_size=1, the \r chunks are emptied by the fix, and the
+        #last non-empty chunk decides whether there's a trailing newline
+        for chunk_size in [1, 2, 1 << 20]:
+            self.assertEqual(self.fix('a\r\nb\n\r\r', chunk_size), ('a\nb\n', 2))
+            self.assertEqual(self.fix('a\r\nb\r', chunk_size), ('a\nb', 2))
+            self.assertEqual(self.fix('\r\r\r', chunk_size), ('', 0))
+
+    def test_fix_and_count_broken_chars(self):
+        text = 'a\x00b\u200c\n\ufeffc\r\n'
+        self.assertEqual(self.fix(text, 2), ('ab\nc\n', 2))
+
+    def test_fix_and_count_empty_file(self):
+        self.assertEqual(self.fix('', 1), ('', 0))
+
+    def test_get_file_length(self):
+        cases = [
+            ('', 0),
+            ('\n', 1),
+            ('a\nb\n', 2),
+            ('a\nb', 2),
+            ('a\r\nb\r', 2),
+            ('é\nà', 2),
+        ]
+        for (text, length) in cases:
+            fp = self.write('in.txt', text)
+            for chunk_size in [1, 2, 3, 1 << 24]:
+                self.assertEqual(get_file_length(fp, chunk_size=chunk_size), length)
+
+
+if __name__ == '__main__':
+    unittest.main()
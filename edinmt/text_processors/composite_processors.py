@@ -40,6 +40,9 @@ class MultilingualSpmTextProcessor(TextProcessor):
     def preprocess_before_wrap(self, text):
         return self.bper.preprocess(text).strip()
 
+    def preprocess_before_wrap_lines(self, texts):
+        return [t.strip() for t in self.bper.preprocess_before_wrap_lines(texts)]
+
     def preprocess_after_wrap(self, text):
         text = text.strip()
         new_text = ''
@@ -104,6 +107,9 @@ class SpmMultilingualTextProcessor(TextProcessor):
     def preprocess_before_wrap(self, text):
         return self.bper.preprocess(text).strip()
 
+    def preprocess_before_wrap_lines(self, texts):
+        return [t.strip() for t in self.bper.preprocess_before_wrap_lines(texts)]
+
     def preprocess_after_wrap(self, text):
         new_text = ''
         for line in text.split(os.linesep):
@@ -154,6 +160,11 @@ class MosesTextProcessor(TextProcessor):
         text = self.moses_tok.postprocess(text).strip()
         return text
 
+    def postprocess_lines(self, texts):
+        texts = [t.strip() for t in self.moses_trc.postprocess_lines(texts)]
+        texts = [t.strip() for t in self.moses_tok.postprocess_lines(texts)]
+        return texts
+
     def preprocess_file(self, input_fp, output_fp):
         fp = self.moses_tok.preprocess_file(input_fp, input_fp + '.tok')
         fp = self.moses_trc.preprocess_file(fp, output_fp)
@@ -180,6 +191,11 @@ class MosesSubwordNmtTextProcessor(TextProcessor):
         text = self.moses.postprocess(text).strip()
         return text
 
+    def postprocess_lines(self, texts):
+        texts = [t.strip() for t in self.sbwrd.postprocess_lines(texts)]
+        texts = [t.strip() for t in self.moses.postprocess_lines(texts)]
+        return texts
+
     def preprocess_file(self, input_fp, output_fp):
         fp = self.moses.preprocess_file(input_fp, input_fp + '.moses')
         fp = self.sbwrd.preprocess_file(fp, output_fp)
@@ -202,6 +218,9 @@ class NormSubwordNmtTextProcessor(TextProcessor):
     def postprocess(self, text):
         return self.norm.postprocess(self.sbwrd.postprocess(text))
 
+    def postprocess_lines(self, texts):
+        return self.norm.postprocess_lines(self.sbwrd.postprocess_lines(texts))
+
 class QueryMosesSubwordNmtTextProcessor(TextProcessor):
     def __init__(self, src_lang, tgt_lang, **kwargs):
         super().__init__(src_lang, tgt_lang, **kwargs)
@@ -220,6 +239,11 @@ class QueryMosesSubwordNmtTextProcessor(TextProcessor):
         text = self.moses.postprocess(text)
         return text 
 
+    def postprocess_lines(self, texts):
+        texts = self.sbwrd.postprocess_lines(texts)
+        texts = self.moses.postprocess_lines(texts)
+        return texts 
+
     def preprocess_file(self, input_fp, output_fp):
         fp = self.query.preprocess_file(input_fp, input_fp + '.query')
         fp = self.moses.preprocess_file(fp, fp + '.moses')
@@ -249,6 +273,11 @@ class RemovePunctMosesSubwordNmtTextProcessor(TextProcessor):
         text = self.moses.postprocess(text)
         return text 
 
+    def postprocess_lines(self, texts):
+        texts = self.sbwrd.postprocess_lines(texts)
+        texts = self.moses.postprocess_lines(texts)
+        return texts 
+
     def preprocess_file(self, input_fp, output_fp):
         fp = self.punct.preprocess_file(input_fp, input_fp + '.punct')
         fp = self.moses.preprocess_file(fp, fp + '.moses')
@@ -278,6 +307,11 @@ class MosesNormPunctMosesSubwordNmtTextProcessor(TextProcessor):
         text = self.moses.postprocess(text)
         return text 
 
+    def postprocess_lines(self, texts):
+        texts = self.sbwrd.postprocess_lines(texts)
+        texts = self.moses.postprocess_lines(texts)
+        return texts 
+
     def preprocess_file(self, input_fp, output_fp):
         fp = self.punct.preprocess_file(input_fp, input_fp + '.punct')
         fp = self.moses.preprocess_file(fp, fp + '.moses')
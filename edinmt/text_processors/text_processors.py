@@ -17,7 +17,7 @@ import pathlib
 import shutil
 import subprocess
 from abc import ABC, abstractmethod
-from functools import partial
+from functools import lru_cache, partial
 from subprocess import PIPE, Popen, STDOUT
 from typing import *
 
@@ -39,6 +39,23 @@ logger.handlers = [h for h in handlers if not isinstance(h, logging.StreamHandle
 class TextProcessorException(BaseException):
     r"""Raise for errors in running text_processors."""
 
+def process_lines_at_once(process: Callable[[str], str], texts: list) -> list:
+    r"""
+    Run a line-based process (e.g. a moses script that we'd otherwise start 
+    once per line) once over all the texts joined by newlines, and split the
+    output back up. Falls back to one line at a time if the texts contain
+    newlines themselves or the output doesn't have a line for each text.
+    """
+    if texts and not any('\n' in text for text in texts):
+        output = process('\n'.join(texts) + '\n')
+        if output.endswith('\n'):
+            output = output[:-1]
+        lines = output.split('\n')
+        if len(lines) == len(texts):
+            return lines
+        logger.warning(f"Expected {len(texts)} lines but got {len(lines)}; processing one line at a time instead.")
+    return [process(text) for text in texts]
+
 class TextProcessor():
     r"""
     Pre-/post-processes text prior (the step prior to sending to MT). Includes
@@ -108,6 +125,25 @@ class TextProcessor():
         new_text = new_text.strip()
         return new_text, len(new_text.split('\n'))
 
+    @staticmethod
+    def wrap_texts(texts, max_length, before_wrap_lines=None, after_wrap=None):
+        """
+        Same as wrap_text, but for a whole batch of texts, where the 
+        before_wrap_lines preprocesses all the texts in one call (e.g. so
+        that SentencePiece can encode the whole batch at once).
+        Returns the list of wrapped texts and the list of their lengths.
+        """
+        if before_wrap_lines:
+            texts = before_wrap_lines(texts)
+        wrapped = []
+        lengths = []
+        for text in texts:
+            new_text, length = TextProcessor.wrap_text(
+                text, max_length, after_wrap=after_wrap)
+            wrapped.append(new_text)
+            lengths.append(length)
+        return wrapped, lengths
+
     def preprocess(self, text: str) -> str:
         """Preprocess one line of text."""
         return text #noop returns unchanged text 
@@ -116,6 +152,14 @@ class TextProcessor():
         """Postprocess one line of mt output text."""
         return text #noop returns unchanged text 
 
+    def postprocess_lines(self, texts: list) -> list:
+        """
+        Postprocess a batch of lines of mt output text; subclasses can
+        override this to process the whole batch at once (base class does
+        one line at a time).
+        """
+        return [self.postprocess(text) for text in texts]
+
     def preprocess_file(self, input_fp: str, output_fp: str) -> str:
         """Postprocess a file (base class does one line at a time)."""
         with open(input_fp, 'r', encoding='utf-8') as infile, \
@@ -143,6 +187,14 @@ class TextProcessor():
         """
         return self.preprocess(text) 
 
+    def preprocess_before_wrap_lines(self, texts: list) -> list:
+        """
+        Do preprocess_before_wrap on a batch of lines; subclasses can override
+        this to process the whole batch at once (base class does one line at
+        a time).
+        """
+        return [self.preprocess_before_wrap(text) for text in texts]
+
     def preprocess_after_wrap(self, text: str) -> str:
         """
         Do additional preprocessing on lines after they've been split 
@@ -204,6 +256,11 @@ class MultilingualTextProcessor(TextProcessor):
         return f"{tag} {text.strip()}"
 
 
+@lru_cache(maxsize=None)
+def _load_spm(model_file):
+    r"""Load the SentencePiece model once per model file, not once per line."""
+    return spm.SentencePieceProcessor(model_file=model_file)
+
 class SpmTextProcessor(TextProcessor):
     r"""Byte-pair encode the text using SentencePiece BPE."""
     def __init__(self, src_lang, tgt_lang, bpe_model=None, **kwargs):
@@ -217,11 +274,18 @@ class SpmTextProcessor(TextProcessor):
             )
 
     def preprocess(self, text):
-        s = spm.SentencePieceProcessor(model_file=self.bpe_model)
+        s = _load_spm(self.bpe_model)
         result = s.encode(text, out_type=str, enable_sampling=False, alpha=0.1)
         result = ' '.join(result)
         return result
 
+    def preprocess_before_wrap_lines(self, texts):
+        #spm encodes the whole batch at once (in C)
+        s = _load_spm(self.bpe_model)
+        results = s.encode(
+            list(texts), out_type=str, enable_sampling=False, alpha=0.1)
+        return [' '.join(result) for result in results]
+
     def postprocess(self, text):
         #fast method from spm paper: https://arxiv.org/pdf/1808.06226.pdf
         text = text.strip().split() 
@@ -268,6 +332,10 @@ class MosesTokenizerTextProcessor(TextProcessor):
 
         return text
 
+    def postprocess_lines(self, texts):
+        #start the detokenizer once for the whole batch, not once per line
+        return process_lines_at_once(self.postprocess, texts)
+
     def preprocess_file(self, input_fp: str, output_fp: str) -> str:
         if self.parallel:
             cmd = [
@@ -342,6 +410,10 @@ class MosesTruecaserTextProcessor(TextProcessor):
 
         return text
 
+    def postprocess_lines(self, texts):
+        #start the detruecaser once for the whole batch, not once per line
+        return process_lines_at_once(self.postprocess, texts)
+
     def preprocess_file(self, input_fp: str, output_fp: str) -> str:
         #NOTE: we don't use gnu parallel here because loading the truecase 
         #model is the slow part, but it could be done with:
@@ -8,9 +8,9 @@ from typing import *
 
 from edinmt import CONFIG
 from edinmt.parse_marian import (
-    parse, 
-    parse_nbest_words, 
-    unwrap_lines,
+    iter_parse, 
+    iter_parse_nbest_words, 
+    iter_unwrap_lines,
     fmt_item
 )
 from edinmt.text_processors.text_processors import (
@@ -218,13 +218,14 @@ def translate(
     logger.debug(f"Parsing output {mtout_fp} -> {final_fp}")
     with open(mtout_fp, 'r', encoding='utf-8') as infile, \
          open(final_fp, 'w', encoding='utf-8') as outfile:
+        #stream parse -> unwrap -> format -> write, never holding all of it
         if n_best_words: #alham's decoder
-            parsed = parse_nbest_words(infile, len(true_ids), n_best)
+            parsed = iter_parse_nbest_words(infile, len(true_ids), n_best)
         else: #normal marian
-            parsed = parse(infile, len(true_ids), n_best)
+            parsed = iter_parse(infile, len(true_ids), n_best)
 
         #glue long lines that were split over items
-        final = unwrap_lines(
+        final = iter_unwrap_lines(
             parsed=parsed, 
             true_ids=true_ids,
             text_processor=text_processor,
@@ -233,9 +234,11 @@ def translate(
             n_best=n_best,
         )
 
-        logger.debug(f"{final_fp} original={len(true_ids)} parsed={len(parsed)} unwrapped={len(final)}")
-
+        n_final = 0
         for item in final:
             text = fmt_item(item, fmt)
             outfile.write(text + '\n')
+            n_final += 1
+
+        logger.debug(f"{final_fp} original={len(true_ids)} unwrapped={n_final}")
     return final_fp
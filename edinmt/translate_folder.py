@@ -32,10 +32,11 @@ from tqdm import tqdm
 from edinmt import CONFIG
 from edinmt import retagger 
 from edinmt.parse_marian import (
-    parse, 
-    parse_nbest_words, 
-    unwrap_lines,
-    fmt_item
+    iter_parse, 
+    iter_parse_nbest_words, 
+    iter_unwrap_lines,
+    fmt_item,
+    json_loads,
 )
 from edinmt.text_processors.text_processors import TextProcessor
 from edinmt.translate_file import (
@@ -106,20 +107,32 @@ def prepare_files(
         output_dir: str,
         suffix: Optional[str]='.rdy',
         extract_tags: Optional[bool]=False,
+        jobs: Optional[int]=None,
     ):
     r"""
-    Preprocess small files to prepare for translation.
+    Preprocess small files to prepare for translation, using a pool of
+    jobs processes (CPU_COUNT by default).
 
     Returns:
         metadata: {created_fp: (relative_name, length, tags_fp)}
     """
     metadata = {}
 
-    inputs = []
-    for root, dirs, files in os.walk(input_dir):
-        for f in files:
-            fp = os.path.join(root, f)
-            inputs.append((fp, input_dir, output_dir, suffix, extract_tags))
+    sizes = {}
+    stack = [input_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink(): #like os.walk, don't follow
+                        stack.append(entry.path)
+                else:
+                    sizes[entry.path] = entry.stat().st_size
+    #biggest files first, so one big file doesn't get left until the end
+    inputs = [
+        (fp, input_dir, output_dir, suffix, extract_tags)
+        for fp in sorted(sizes, key=sizes.get, reverse=True)
+    ]
     total = len(inputs)
 
     pbar = tqdm(total=total, desc="Preparing files")
@@ -128,7 +141,7 @@ def prepare_files(
         metadata[created_fp] = (relative_name, length, tags_fp)
         pbar.update()
 
-    p = multiprocessing.Pool(processes=CONFIG.CPU_COUNT)
+    p = multiprocessing.Pool(processes=int(jobs or CONFIG.CPU_COUNT))
     for i in range(pbar.total):
         p.apply_async(
             prepare_file, 
@@ -215,9 +228,9 @@ def parse_stream_to_files(
         os.makedirs(os.path.dirname(tgt_fp), exist_ok=True)
 
         if n_best_words: #alham's decoder
-            parsed = parse_nbest_words(stream, len(true_ids), n_best)
+            parsed = iter_parse_nbest_words(stream, len(true_ids), n_best)
         else: #normal marian
-            parsed = parse(stream, len(true_ids), n_best)
+            parsed = iter_parse(stream, len(true_ids), n_best)
 
         with open(tgt_fp, 'w', encoding='utf-8') as new_fh:
             for item in parsed:
@@ -243,42 +256,44 @@ def unwrap_and_postprocess_file(
     split into longer lines during preprocessing using the true_ids list.
     """ 
     os.makedirs(os.path.dirname(output_fp), exist_ok=True)
-    with open(input_fp, 'r', encoding='utf-8') as infile:
-        parsed = [json.loads(line.strip()) for line in infile] 
-
     tagged = {}
     if tags_fp:
         with open(tags_fp, 'r', encoding='utf-8') as infile:
             for j, line in enumerate(infile):
-                tags = json.loads(line)
+                tags = json_loads(line)
                 if tags:
                     tagged[j] = tags
 
-    final = unwrap_lines(
-        parsed=parsed, 
-        true_ids=true_ids,
-        text_processor=text_processor,
-        empties=empties,
-        tagged=tagged,
-        n_best=n_best,
-    )
+    #stream read -> unwrap -> format -> write, never holding all of it
+    with open(input_fp, 'r', encoding='utf-8') as infile, \
+         open(output_fp, 'w', encoding='utf-8') as new_fh:
+        parsed = map(json_loads, infile)
+        final = iter_unwrap_lines(
+            parsed=parsed, 
+            true_ids=true_ids,
+            text_processor=text_processor,
+            empties=empties,
+            tagged=tagged,
+            n_best=n_best,
+        )
+        n_final = 0
+        for item in final:
+            text = fmt_item(item, fmt)
+            new_fh.write(text + '\n')
+            n_final += 1
     logger.debug(
         f"{input_fp} {output_fp} " \
         f"original_length={len(true_ids)} "\
-        f"parsed={len(parsed)} "\
-        f"unwrapped={len(final)}"
+        f"unwrapped={n_final}"
     )
-    with open(output_fp, 'w', encoding='utf-8') as new_fh:
-        for item in final:
-            text = fmt_item(item, fmt)
-            new_fh.write(text + '\n')
     return output_fp
 
-def postprocess_files(metadata, output_dir, text_processor, n_best, fmt, suffix=''):
+def postprocess_files(metadata, output_dir, text_processor, n_best, fmt, suffix='', jobs=None):
     """
     Postprocess small files in parallel. Apply the text_processor and 
     unwrap lines, and write them to output_dir with the same relative name
-    (i.e. directory structure) as in the metadata.
+    (i.e. directory structure) as in the metadata. Uses a pool of jobs
+    processes (CPU_COUNT by default).
     """
     inputs = []
     for input_fp in metadata:
@@ -287,13 +302,15 @@ def postprocess_files(metadata, output_dir, text_processor, n_best, fmt, suffix=
         inputs.append(
             [input_fp, output_fp, true_ids, empties, tags_fp, text_processor, n_best, fmt]
         )
+    #longest files first, so one big file doesn't get left until the end
+    inputs.sort(key=lambda x: len(x[2]), reverse=True)
 
     total = len(inputs)
     pbar = tqdm(total=total, desc="Postprocessing")
     def postprocess_callback(result):
         pbar.update()
 
-    p = multiprocessing.Pool(processes=CONFIG.CPU_COUNT)
+    p = multiprocessing.Pool(processes=int(jobs or CONFIG.CPU_COUNT))
     for i in range(pbar.total):
         p.apply_async(
             unwrap_and_postprocess_file, 
@@ -314,6 +331,7 @@ def translate(
         fmt: Optional[str]='json',
         extract_tags: Optional[bool]=True,
         purge: Optional[bool]=True,
+        jobs: Optional[int]=None,
     ):
     assert fmt in CONFIG.FMTS, f'Expected one of {CONFIG.FMTS} for fmt. Received fmt={fmt}'
 
@@ -324,7 +342,7 @@ def translate(
     tgt_fp = os.path.join(tmpdir, 'tmp.tgt')
 
     #clean > sort + cat > preproc > wrap > translate > postproc + unwrap
-    metadata = prepare_files(input_dir, tmpdir, '.rdy', extract_tags) 
+    metadata = prepare_files(input_dir, tmpdir, '.rdy', extract_tags, jobs) 
     ordered_files = cat_files(tmpdir, big_fp, '.rdy') 
     preproc_fp = text_processor.preprocess_before_wrap_file(big_fp, big_fp + '.preproc')
     wrap_fp, metadata = wrap_files( 
@@ -342,7 +360,7 @@ def translate(
         parsed_ordered_files, parsed_metadata = parse_stream_to_files(
             infile, ordered_files, metadata, tmpdir, n_best, n_best_words
         )
-    postprocess_files(parsed_metadata, output_dir, text_processor, n_best, fmt=fmt)
+    postprocess_files(parsed_metadata, output_dir, text_processor, n_best, fmt=fmt, jobs=jobs)
 
     if purge:
         logger.info("Cleaning up")
@@ -109,10 +109,12 @@ def write(
         n_best: Optional[int]=1,
         n_best_words: Optional[bool]=False,
         fmt: Optional[str]='json',
+        records: Optional[list]=None,
     ):
     r"""
     Receive text from process_stdout, write to output_fh in chunks,
-    according to the count stored in the q.
+    according to the count stored in the q. If a records list is given,
+    the output items are appended to it instead (not formatted/written).
     """
     sentence_id = 0
     while True:
@@ -146,9 +148,11 @@ def write(
                 i = 0
             item["id"] = sentence_id
 
-            text = fmt_item(item, fmt)
-
-            output_fh.write(text + '\n')
+            if records is not None:
+                records.append(item)
+            else:
+                text = fmt_item(item, fmt)
+                output_fh.write(text + '\n')
             i += 1
         sentence_id += n_items
         
@@ -165,6 +169,7 @@ def translate(
         n_best_words: Optional[bool]=False,
         fmt: Optional[str]='json',
         extract_tags: Optional[bool]=False,
+        records: Optional[list]=None,
     ):
     logger.debug(f"RUNNING: {' '.join(subcommand)}")
 
@@ -182,7 +187,7 @@ def translate(
     writer = threading.Thread(
         target=write, 
         args=(output_fh, process.stdout, q, text_processor, 
-              batch_size, n_best, n_best_words, fmt)
+              batch_size, n_best, n_best_words, fmt, records)
     )
     reader.start()
     writer.start()
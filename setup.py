@@ -27,5 +27,11 @@ setup(
         'Operating System :: Unix',
         'Operating System :: MacOS',
     ],
-    packages=find_packages()
+    packages=find_packages(),
+    entry_points={
+        'edinmt.scorers': [
+            'SacrebleuScorer = edinmt.scorers.scorers:SacrebleuScorer',
+            'QueryScorer = edinmt.scorers.scorers:QueryScorer',
+        ],
+    },
 )